@@ -21,6 +21,7 @@ import click
 import httpx
 import jsonpickle
 import nest_asyncio
+import orjson
 import pyperclip
 import requests
 import rich
@@ -28,7 +29,6 @@ from anthropic.lib.streaming._messages import AsyncMessageStreamManager
 from anthropic.types.completion import Completion
 from click import MissingParameter
 from click_default_group import DefaultGroup
-from google.generativeai.types import AsyncGenerateContentResponse
 from httpx import ConnectError
 from PIL import Image
 from prompt_toolkit import PromptSession
@@ -44,17 +44,13 @@ from rich.console import Console, ConsoleOptions, RenderResult
 from rich.markdown import CodeBlock, Markdown
 from rich.syntax import Syntax
 
-from llmvm.common.anthropic_executor import AnthropicExecutor
 from llmvm.common.container import Container
-from llmvm.common.gemini_executor import GeminiExecutor
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
-from llmvm.common.mistral_executor import MistralExecutor
 from llmvm.common.objects import (Assistant, AstNode, Content, DownloadItem,
                                   Executor, FileContent, ImageContent, Message,
                                   MessageModel, PdfContent, SessionThread,
                                   StreamNode, System, TokenStopNode, User)
-from llmvm.common.openai_executor import OpenAIExecutor
 from llmvm.common.perf import TokenPerfWrapper, TokenPerfWrapperAnthropic
 
 nest_asyncio.apply()
@@ -346,6 +342,9 @@ def get_path_as_messages(
 
 
 async def stream_gpt_response(response, print_lambda: Callable):
+    # a gemini response can only exist if the gemini executor (and so its sdk) has been imported
+    gemini_types = sys.modules.get('google.generativeai.types')
+
     async with async_timeout.timeout(300):
         # anthropic new messages API
         if isinstance(response, AsyncMessageStreamManager) or isinstance(response, TokenPerfWrapperAnthropic):
@@ -356,7 +355,11 @@ async def stream_gpt_response(response, print_lambda: Callable):
             _ = await stream_async.get_final_message()
             print_lambda('\n')
             return
-        if isinstance(response, TokenPerfWrapper) and isinstance(response.stream, AsyncGenerateContentResponse):
+        if (
+            gemini_types
+            and isinstance(response, TokenPerfWrapper)
+            and isinstance(response.stream, gemini_types.AsyncGenerateContentResponse)
+        ):
             async for chunk in response:
                 print_lambda(chunk.text)
             print_lambda('\n')
@@ -445,7 +448,7 @@ async def get_thread(
         'id': id,
     }
     response: httpx.Response = httpx.get(f'{api_endpoint}/v1/chat/get_thread', params=params)
-    thread = SessionThread.model_validate(response.json())
+    thread = SessionThread.model_validate(orjson.loads(response.content))
     return thread
 
 
@@ -456,9 +459,10 @@ async def set_thread(
     async with httpx.AsyncClient(timeout=300.0) as client:
         response = await client.post(
             f'{api_endpoint}/v1/chat/set_thread',
-            json=thread.model_dump()
+            content=orjson.dumps(thread.model_dump()),
+            headers={'Content-Type': 'application/json'},
         )
-        session_thread = SessionThread.model_validate(response.json())
+        session_thread = SessionThread.model_validate(orjson.loads(response.content))
         return session_thread
 
 
@@ -466,7 +470,7 @@ async def get_threads(
     api_endpoint: str,
 ):
     response: httpx.Response = httpx.get(f'{api_endpoint}/v1/chat/get_threads')
-    thread = cast(List[SessionThread], TypeAdapter(List[SessionThread]).validate_python(response.json()))
+    thread = cast(List[SessionThread], TypeAdapter(List[SessionThread]).validate_python(orjson.loads(response.content)))
     return thread
 
 
@@ -489,22 +493,28 @@ async def __execute_llm_call_direct(
     messages_list = [Message.to_dict(m, server_serialization=False) for m in list(context_messages) + [message]]
     executor: Optional[Executor] = None
 
+    # executor sdks (grpc for gemini in particular) are slow to import, and most client
+    # invocations talk to the server instead, so only import the one that's asked for
     if executor_name == 'openai':
+        from llmvm.common.openai_executor import OpenAIExecutor
         executor = OpenAIExecutor(
             api_key=api_key,
             default_model=model_name,
         )
     elif executor_name == 'anthropic':
+        from llmvm.common.anthropic_executor import AnthropicExecutor
         executor = AnthropicExecutor(
             api_key=api_key,
             default_model=model_name,
         )
     elif executor_name == 'mistral':
+        from llmvm.common.mistral_executor import MistralExecutor
         executor = MistralExecutor(
             api_key=api_key,
             default_model=model_name,
         )
     elif executor_name == 'gemini':
+        from llmvm.common.gemini_executor import GeminiExecutor
         executor = GeminiExecutor(
             api_key=api_key,
             default_model=model_name,
@@ -564,7 +574,9 @@ async def execute_llm_call(
             async with client.stream(
                 'POST',
                 f'{api_endpoint}/v1/chat/{endpoint}',
-                json=thread.model_dump(),
+                # threads carry base64 encoded images and pdfs, so serialize with orjson rather than stdlib json
+                content=orjson.dumps(thread.model_dump()),
+                headers={'Content-Type': 'application/json'},
             ) as response:
                 objs = await stream_response(response, StreamPrinter('').write)
 
@@ -826,9 +838,10 @@ def print_response(messages: List[Message], suppress_role: bool = False):
     def contains_token(s, tokens):
         return any(token in s for token in tokens)
 
+    console = Console()
+
     def pprint(prepend: str, content: Content):
         markdown_tokens = ['###', '* ', '](', '```', '## ']
-        console = Console()
 
         if isinstance(content, ImageContent):
             console.print(f'{prepend}\n', end='')
@@ -933,7 +946,7 @@ class Repl():
     def __init__(
         self,
     ):
-        pass
+        self.console = Console()
 
     def open_editor(self, editor: str, initial_text: str) -> str:
         temp_file_name = ''
@@ -967,37 +980,37 @@ class Repl():
             for cmd_name in ctx.command.list_commands(ctx)  # type: ignore
         }
 
-        rich.print()
-        rich.print('[red]Commands:[/red]')
+        self.console.print()
+        self.console.print('[red]Commands:[/red]')
         for key, value in commands.items():
             if key == 'message':
                 key = 'message [red](default)[/red]'
-            rich.print(f' [green]{key.ljust(23)}[/green]  {value}')
+            self.console.print(f' [green]{key.ljust(23)}[/green]  {value}')
             for argument in [param for param in ctx.command.get_command(ctx, key).params if isinstance(param, click.Argument)]:  # type: ignore  # NOQA: E501
-                rich.print(f'  ({argument.name}')
+                self.console.print(f'  ({argument.name}')
             for option in [param for param in ctx.command.get_command(ctx, key).params if isinstance(param, click.Option)]:  # type: ignore  # NOQA: E501
-                rich.print(f'  {str(", ".join(option.opts)).ljust(25)} {option.help if option.help else ""}')
-
-        rich.print()
-        rich.print(f'$LLMVM_EXECUTOR: {Container.get_config_variable("LLMVM_EXECUTOR", default="(not set)")}')
-        rich.print(f'$LLMVM_MODEL: {Container.get_config_variable("LLMVM_MODEL", default="(not set)")}')
-        rich.print()
-        rich.print('[bold]Keys:[/bold]')
-        rich.print('[white](Ctrl-c or "exit" to exit, or cancel current request)[/white]')
-        rich.print('[white](Ctrl-n to create a new thread)[/white]')
-        rich.print('[white](Ctrl-e to open $EDITOR for multi-line User prompt)[/white]')
-        rich.print('[white](Ctrl-g to open $EDITOR for full message thread editing)[/white]')
-        rich.print('[white](Ctrl-r search prompt history)[/white]')
-        rich.print('[white](Ctrl-y+y yank the last message to the clipboard)[/white]')
-        rich.print('[white](Ctrl-y+a yank entire message thread to clipboard)[/white]')
-        rich.print('[white](Ctrl-y+c yank code blocks to clipboard)[/white]')
-        rich.print('[white](Ctrl-y+p paste image from clipboard into message)[/white]')
-        rich.print('')
-        rich.print('[white](If the LLMVM server.py is not running, messages are executed directly)[/white]')
-        rich.print('[white]("message" is the default command, so you can omit it)[/white]')
-        rich.print()
-        rich.print('[bold]I am a helpful assistant that has access to tools. Use "mode" to switch tools on and off.[/bold]')
-        rich.print()
+                self.console.print(f'  {str(", ".join(option.opts)).ljust(25)} {option.help if option.help else ""}')
+
+        self.console.print()
+        self.console.print(f'$LLMVM_EXECUTOR: {Container.get_config_variable("LLMVM_EXECUTOR", default="(not set)")}')
+        self.console.print(f'$LLMVM_MODEL: {Container.get_config_variable("LLMVM_MODEL", default="(not set)")}')
+        self.console.print()
+        self.console.print('[bold]Keys:[/bold]')
+        self.console.print('[white](Ctrl-c or "exit" to exit, or cancel current request)[/white]')
+        self.console.print('[white](Ctrl-n to create a new thread)[/white]')
+        self.console.print('[white](Ctrl-e to open $EDITOR for multi-line User prompt)[/white]')
+        self.console.print('[white](Ctrl-g to open $EDITOR for full message thread editing)[/white]')
+        self.console.print('[white](Ctrl-r search prompt history)[/white]')
+        self.console.print('[white](Ctrl-y+y yank the last message to the clipboard)[/white]')
+        self.console.print('[white](Ctrl-y+a yank entire message thread to clipboard)[/white]')
+        self.console.print('[white](Ctrl-y+c yank code blocks to clipboard)[/white]')
+        self.console.print('[white](Ctrl-y+p paste image from clipboard into message)[/white]')
+        self.console.print('')
+        self.console.print('[white](If the LLMVM server.py is not running, messages are executed directly)[/white]')
+        self.console.print('[white]("message" is the default command, so you can omit it)[/white]')
+        self.console.print()
+        self.console.print('[bold]I am a helpful assistant that has access to tools. Use "mode" to switch tools on and off.[/bold]')
+        self.console.print()
 
     async def repl(
         self,
@@ -1007,7 +1020,7 @@ class Repl():
         global last_thread
 
         ctx = click.Context(cli)
-        console = Console()
+        console = self.console
         history = FileHistory(os.path.expanduser('~/.local/share/llmvm/.repl_history'))
         kb = KeyBindings()
         current_mode = 'auto'
@@ -1024,8 +1037,8 @@ class Repl():
             if 'last_thread' in globals():
                 last_thread_t: SessionThread = last_thread
                 pyperclip.copy(str(last_thread_t.messages[-1].content))
-                rich.print('Last message copied to clipboard.\n')
-                rich.print(f"[{thread_id}] query>> ", end="")
+                self.console.print('Last message copied to clipboard.\n')
+                self.console.print(f"[{thread_id}] query>> ", end="")
 
         @kb.add('c-y', 'a')
         def _(event):
@@ -1033,8 +1046,8 @@ class Repl():
                 last_thread_t: SessionThread = last_thread
                 whole_thread = get_string_thread_with_roles(last_thread_t)
                 pyperclip.copy(str(whole_thread))
-                rich.print('Thread copied to clipboard.\n')
-                rich.print(f"[{thread_id}] query>> ", end="")
+                self.console.print('Thread copied to clipboard.\n')
+                self.console.print(f"[{thread_id}] query>> ", end="")
 
         @kb.add('c-y', 'c')
         def _(event):
@@ -1046,11 +1059,11 @@ class Repl():
                 if code_blocks:
                     code = '\n\n'.join(code_blocks)
                     pyperclip.copy(code)
-                    rich.print('Code blocks copied to clipboard.\n')
-                    rich.print(f"[{thread_id}] query>> ", end="")
+                    self.console.print('Code blocks copied to clipboard.\n')
+                    self.console.print(f"[{thread_id}] query>> ", end="")
                 else:
-                    rich.print('No code block found.\n')
-                    rich.print(f"[{thread_id}] query>> ", end="")
+                    self.console.print('No code block found.\n')
+                    self.console.print(f"[{thread_id}] query>> ", end="")
 
         async def __invoke_paste_image(thread: SessionThread, raw_data: bytes, current_text: str):
             global current_mode
@@ -1120,8 +1133,8 @@ class Repl():
 
                     #     asyncio.create_task(__invoke_paste_image(thread, raw_data, current_text))
             else:
-                rich.print('No image found in clipboard.\n')
-                rich.print(f"[{thread_id}] query>> ", end="")
+                self.console.print('No image found in clipboard.\n')
+                self.console.print(f"[{thread_id}] query>> ", end="")
 
         @kb.add('c-n')
         def _(event):
@@ -1129,10 +1142,10 @@ class Repl():
 
             thread = asyncio.run(get_thread(Container.get_config_variable('LLMVM_ENDPOINT', default='http://127.0.0.1:8011'), 0))
             thread_id = thread.id
-            rich.print('New thread created.')
+            self.console.print('New thread created.')
             event.app.current_buffer.text = ''
             event.app.current_buffer.cursor_position = 0
-            rich.print(f"[{thread_id}] query>> ", end="")
+            self.console.print(f"[{thread_id}] query>> ", end="")
 
         @kb.add('c-g')
         def _(event):
@@ -1228,42 +1241,29 @@ class Repl():
                     # copy the last assistant message to the clipboard
                     last_thread_t: SessionThread = last_thread
                     pyperclip.copy(str(last_thread_t.messages[-1].content))
-                    rich.print('Last message copied to clipboard.')
+                    self.console.print('Last message copied to clipboard.')
                     continue
 
-                # see if the first argument is a command
-                args = query.split(' ')
+                # see if the first argument is a command, otherwise it's the default message command
+                command_name = query.partition(' ')[0]
+                if command_name not in commands:
+                    command_name = 'message'
 
-                if args[0] in commands:
-                    command = ctx.command.get_command(ctx, args[0])  # type: ignore
-                    tokens = parse_command_string(query, command)
-                    tokens = repl_default_option(command, tokens)
+                command = ctx.command.get_command(ctx, command_name)  # type: ignore
+                tokens = parse_command_string(query, command)
+                tokens = repl_default_option(command, tokens)
 
-                    command_executing = True
-                    thread = command.invoke(ctx, **{
-                        param.name: value
-                        for param, value in zip(command.params, command.parse_args(ctx, tokens))  # args[1:]))
-                    })
-                    command_executing = False
-                    if thread and isinstance(thread, SessionThread):
-                        thread_id = thread.id
-                else:
-                    # default message command
-                    command = ctx.command.get_command(ctx, 'message')  # type: ignore
-                    tokens = parse_command_string(query, command)
-                    tokens = repl_default_option(command, tokens)
-
-                    command_executing = True
-                    thread = command.invoke(ctx, **{
-                        param.name: value
-                        for param, value in zip(command.params, command.parse_args(ctx, tokens))
-                    })
-                    command_executing = False
-                    if thread and isinstance(thread, SessionThread):
-                        thread_id = thread.id
+                command_executing = True
+                thread = command.invoke(ctx, **{
+                    param.name: value
+                    for param, value in zip(command.params, command.parse_args(ctx, tokens))
+                })
+                command_executing = False
+                if thread and isinstance(thread, SessionThread):
+                    thread_id = thread.id
 
             except KeyboardInterrupt:
-                rich.print("\nKeyboardInterrupt")
+                self.console.print("\nKeyboardInterrupt")
                 if command_executing:
                     command_executing = False
                     continue
@@ -5,7 +5,7 @@ from anthropic import AI_PROMPT, HUMAN_PROMPT, AsyncAnthropic
 
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Assistant, AstNode, Content, Executor,
-                                  Message, System, TokenStopNode, User,
+                                  Message, System, TokenStopNode,
                                   awaitable_none)
 from llmvm.common.perf import (TokenPerf, TokenPerfWrapper,
                                TokenPerfWrapperAnthropic)
@@ -120,12 +120,13 @@ class AnthropicExecutor(Executor):
 
         if isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], Message):
             dict_messages = [Message.to_dict(m) for m in messages]  # type: ignore
-            dict_messages.append(Message.to_dict(User(Content(extra_str))))
+            # plain strings don't need to round-trip through User/Content to be counted
+            dict_messages.append({'role': 'user', 'content': extra_str})
             return num_tokens_from_messages(dict_messages, model=model_str)
         elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], dict):
             return num_tokens_from_messages(messages, model=model_str)
         elif isinstance(messages, str):
-            return num_tokens_from_messages([Message.to_dict(User(Content(messages)))], model=model_str)
+            return num_tokens_from_messages([{'role': 'user', 'content': messages}], model=model_str)
         else:
             raise ValueError('cannot calculate tokens for messages: {}'.format(messages))
 
@@ -223,10 +224,7 @@ class AnthropicExecutor(Executor):
         model = model if model else self.default_model
 
         def last(predicate, iterable):
-            result = [x for x in iterable if predicate(x)]
-            if result:
-                return result[-1]
-            return None
+            return next((x for x in reversed(iterable) if predicate(x)), None)
 
         # find the system message and append to the front
         system_message = last(lambda x: x.role() == 'system', messages)
@@ -248,13 +246,13 @@ class AnthropicExecutor(Executor):
             temperature=temperature,
         )
 
-        text_response = ''
+        text_chunks: List[str] = []
 
         if self.beta:
             async with await stream as stream_async:  # type: ignore
                 async for text in stream_async.text_stream:  # type: ignore
                     await stream_handler(Content(text))
-                    text_response += text
+                    text_chunks.append(text)
                 await stream_handler(TokenStopNode())
 
             _ = await stream_async.get_final_message()  # type: ignore
@@ -262,9 +260,10 @@ class AnthropicExecutor(Executor):
             async for completion in await stream:  # type: ignore
                 s = completion.completion
                 await stream_handler(Content(s))
-                text_response += s
+                text_chunks.append(s)
             await stream_handler(TokenStopNode())
 
+        text_response = ''.join(text_chunks)
         messages_list.append({'role': 'assistant', 'content': text_response})
         conversation: List[Message] = [Message.from_dict(m) for m in messages_list]
 
@@ -1,9 +1,12 @@
 import json
 from importlib import resources
-from typing import Optional
+from typing import Any, Dict, Optional
 
 
 class TokenPriceCalculator():
+    # a calculator is built for every TokenPerf (i.e. every LLM call), so parse each price file once per process
+    _prices_cache: Dict[str, Dict[str, Any]] = {}
+
     def __init__(
         self,
         price_file: str = 'model_prices_and_context_window.json',
@@ -12,9 +15,11 @@ class TokenPriceCalculator():
         self.prices = self.__load_prices()
 
     def __load_prices(self):
-        with open(self.price_file, 'r') as f:  # type: ignore
-            json_prices = json.load(f)
-            return json_prices
+        key = str(self.price_file)
+        if key not in TokenPriceCalculator._prices_cache:
+            with open(self.price_file, 'r') as f:  # type: ignore
+                TokenPriceCalculator._prices_cache[key] = json.load(f)
+        return TokenPriceCalculator._prices_cache[key]
 
     def prompt_price(
         self,
@@ -6,7 +6,7 @@ import google.generativeai as genai
 
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Assistant, AstNode, Content, Executor,
-                                  Message, TokenStopNode, User, awaitable_none)
+                                  Message, TokenStopNode, awaitable_none)
 from llmvm.common.perf import TokenPerf, TokenPerfWrapper
 
 logging = setup_logging()
@@ -98,12 +98,13 @@ class GeminiExecutor(Executor):
 
         if isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], Message):
             dict_messages = [Message.to_dict(m) for m in messages]  # type: ignore
-            dict_messages.append(Message.to_dict(User(Content(extra_str))))
+            # plain strings don't need to round-trip through User/Content to be counted
+            dict_messages.append({'role': 'user', 'content': extra_str})
             return num_tokens_from_messages(dict_messages, model=model_str)
         elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], dict):
             return num_tokens_from_messages(messages, model=model_str)
         elif isinstance(messages, str):
-            return num_tokens_from_messages([Message.to_dict(User(Content(messages)))], model=model_str)
+            return num_tokens_from_messages([{'role': 'user', 'content': messages}], model=model_str)
         else:
             raise ValueError('cannot calculate tokens for messages: {}'.format(messages))
 
@@ -191,14 +192,17 @@ class GeminiExecutor(Executor):
             temperature=temperature,
         )
 
-        text_response = ''
+        text_chunks: List[str] = []
 
         async for chunk in await chat_response:  # type: ignore
             s = chunk.text or ''
+            if not s:
+                continue
             await stream_handler(Content(s))
-            text_response += s
+            text_chunks.append(s)
         await stream_handler(TokenStopNode())
 
+        text_response = ''.join(text_chunks)
         messages_list.append({'role': 'assistant', 'content': text_response})
         conversation: List[Message] = [Message.from_dict(m) for m in messages_list]
 
@@ -2,6 +2,7 @@ import asyncio
 import base64
 import datetime as dt
 import glob
+import hashlib
 import importlib
 import inspect
 import io
@@ -10,21 +11,32 @@ import math
 import os
 import re
 import typing
-from collections import Counter
+from collections import Counter, OrderedDict
 from enum import Enum, IntEnum
-from functools import reduce
+from functools import lru_cache, reduce
 from importlib import resources
 from itertools import cycle, islice
 from logging import Logger
-from typing import Any, Callable, Dict, Generator, List, Optional
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
 
 import nest_asyncio
 import psutil
+import tiktoken
 from docstring_parser import parse
 from PIL import Image
 
 from llmvm.common.objects import Content, Message, StreamNode, User
 
+_TEMPLATE_RE = re.compile(r'\{\{([^{}]+)\}\}')
+
+_token_len_cache: 'OrderedDict[Tuple[str, bytes], int]' = OrderedDict()
+_TOKEN_LEN_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(encoding_name: str = 'cl100k_base') -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
 
 def write_client_stream(obj):
     if isinstance(obj, bytes):
@@ -44,7 +56,40 @@ def write_client_stream(obj):
         frame = frame.f_back
 
 
+def pure(func):
+    """
+    Marks a tool as deterministic for its arguments, so the runtime can
+    memoize repeated calls within a session.
+    """
+    func._pure = True
+    return func
+
+
 class Helpers():
+    @staticmethod
+    def cached_token_len(text: str, token_len: Callable[[str], int], namespace: str = '') -> int:
+        # the same messages and chunks get counted several times per llm call (compression checks,
+        # similarity ranking, then again in the executor), so memoize on a digest of the text rather
+        # than holding on to the text itself. namespace separates tokenizers/models.
+        key = (namespace, hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest())
+        if key in _token_len_cache:
+            _token_len_cache.move_to_end(key)
+            return _token_len_cache[key]
+
+        length = token_len(text)
+        _token_len_cache[key] = length
+        if len(_token_len_cache) > _TOKEN_LEN_CACHE_SIZE:
+            _token_len_cache.popitem(last=False)
+        return length
+
+    @staticmethod
+    def tiktoken_len(text: str, encoding_name: str = 'cl100k_base') -> int:
+        return Helpers.cached_token_len(
+            text,
+            lambda t: len(_get_encoding(encoding_name).encode(t)),
+            namespace=encoding_name,
+        )
+
     @staticmethod
     def log_exception(logger, e, message=None):
         exc_traceback = e.__traceback__
@@ -126,9 +171,10 @@ class Helpers():
     @staticmethod
     def __find_terminal_emulator(process):
         try:
-            if process.parent():
+            parent = process.parent()
+            while parent:
                 # Check if the process name matches known terminal emulators
-                name = process.parent().name()
+                name = parent.name()
                 if 'Terminal' in name:
                     return 'Terminal'
                 elif 'iTerm' in name:
@@ -140,10 +186,9 @@ class Helpers():
                 elif 'tmux' in name:
                     return 'tmux'
                 # If no match, check the next parent
-                return Helpers.__find_terminal_emulator(process.parent())
-            else:
-                # No more parents, terminal emulator not found
-                return 'Unknown'
+                parent = parent.parent()
+            # No more parents, terminal emulator not found
+            return 'Unknown'
         except Exception as e:
             return str(e)
 
@@ -316,18 +361,18 @@ class Helpers():
 
     @staticmethod
     def flatten(lst):
-        def __has_list(lst):
-            for item in lst:
+        # single pass over arbitrarily nested lists, using an explicit stack of iterators
+        result = []
+        stack = [iter(lst)]
+        while stack:
+            for item in stack[-1]:
                 if isinstance(item, list):
-                    return True
-            return False
-
-        def __inner_flatten(lst):
-            return [item for sublist in lst for item in sublist]
-
-        while __has_list(lst):
-            lst = __inner_flatten(lst)
-        return lst
+                    stack.append(iter(item))
+                    break
+                result.append(item)
+            else:
+                stack.pop()
+        return result
 
     @staticmethod
     def extract_token(s, ident):
@@ -343,24 +388,23 @@ class Helpers():
 
     @staticmethod
     def in_between(s, start, end):
+        # search for end from where start finished, rather than slicing a copy of the tail and scanning that
+        begin = s.find(start) + len(start)
         if end == '\n' and '\n' not in s:
-            return s[s.find(start) + len(start):]
+            return s[begin:]
 
-        after_start = s[s.find(start) + len(start):]
-        part = after_start[:after_start.find(end)]
-        return part
+        return s[begin:s.find(end, begin)]
 
     @staticmethod
     def in_between_ends(s, start, end_strs: List[str]):
         # get the text from s between start and any of the end_strs strings.
         possibilities = []
+        begin = s.find(start) + len(start)
         for end in end_strs:
             if end == '\n' and '\n' not in s:
-                result = s[s.find(start) + len(start):]
-                possibilities.append(result)
+                possibilities.append(s[begin:])
             elif end in s:
-                after_start = s[s.find(start) + len(start):]
-                part = after_start[:after_start.find(end)]
+                part = s[begin:s.find(end, begin)]
                 if part:
                     possibilities.append(part)
 
@@ -402,15 +446,17 @@ class Helpers():
 
     @staticmethod
     def strip_between(s: str, start: str, end: str):
-        first = s[:s.find(start)]
-        rest = s[s.find(start) + len(start):]
-        return first + rest[rest.find(end) + len(end):]
+        first, rest = Helpers.split_between(s, start, end)
+        return first + rest
 
     @staticmethod
     def split_between(s: str, start: str, end: str):
-        first = s[:s.find(start)]
-        rest = s[s.find(start) + len(start):]
-        return (first, rest[rest.find(end) + len(end):])
+        start_index = s.find(start)
+        begin = start_index + len(start)
+        end_index = s.find(end, begin)
+        # a missing end token keeps the old behaviour of slicing from -1 relative to the tail
+        end_offset = end_index - begin if end_index != -1 else -1
+        return (s[:start_index], s[begin + end_offset + len(end):])
 
     @staticmethod
     def first(predicate, iterable):
@@ -426,10 +472,14 @@ class Helpers():
 
     @staticmethod
     def last(predicate, iterable):
-        result = [x for x in iterable if predicate(x)]
-        if result:
-            return result[-1]
-        return None
+        if hasattr(iterable, '__reversed__'):
+            return next((x for x in reversed(iterable) if predicate(x)), None)
+
+        result = None
+        for x in iterable:
+            if predicate(x):
+                result = x
+        return result
 
     @staticmethod
     def resize_image(screenshot_data, base_width=500):
@@ -499,18 +549,30 @@ class Helpers():
             parts_with_period = [bel + '.' for bel in parts if bel]
             sentences.extend(parts_with_period)
 
+        # accumulate the parts of the current chunk and join once, rather than rebuilding
+        # the chunk string for every sentence that gets merged into it
         combined: List[str] = []
+        parts: List[str] = []
+        length = 0
 
         for sentence in sentences:
-            if not combined:
-                combined.append(sentence)
-                continue
-
-            prev = combined[-1]
-            if len(prev) + len(sentence) < max_chunk_length:
-                combined[-1] = f'{prev.strip()} {sentence.strip()}'
+            if not parts:
+                parts.append(sentence)
+                length = len(sentence)
+            elif length + len(sentence) < max_chunk_length:
+                if len(parts) == 1:
+                    parts[0] = parts[0].strip()
+                    length = len(parts[0])
+                stripped = sentence.strip()
+                parts.append(stripped)
+                length += 1 + len(stripped)
             else:
-                combined.append(sentence)
+                combined.append(' '.join(parts))
+                parts = [sentence]
+                length = len(sentence)
+
+        if parts:
+            combined.append(' '.join(parts))
         return combined
 
     @staticmethod
@@ -660,13 +722,14 @@ class Helpers():
             else:
                 return 'string'
 
-        import inspect
+        doc = parse(func.__doc__) if func.__doc__ else None
+        signature = inspect.signature(func)
 
         description = ''
-        if func.__doc__ and parse(func.__doc__).short_description:
-            description = parse(func.__doc__).short_description
-        if func.__doc__ and parse(func.__doc__).long_description:
-            description += ' ' + str(parse(func.__doc__).long_description).replace('\n', ' ')  # type: ignore
+        if doc and doc.short_description:
+            description = doc.short_description
+        if doc and doc.long_description:
+            description += ' ' + str(doc.long_description).replace('\n', ' ')  # type: ignore
 
         func_name = func.__name__
         func_class = Helpers.__get_class_of_func(func)
@@ -675,8 +738,7 @@ class Helpers():
         if openai_format:
             params = {}
 
-            for p in inspect.signature(func).parameters:
-                param = inspect.signature(func).parameters[p]
+            for param in signature.parameters.values():
                 parameter = {
                     param.name: {
                         'type': parse_type(param.annotation) if param.annotation is not inspect._empty else 'string',
@@ -690,21 +752,14 @@ class Helpers():
 
                 params.update(parameter)
 
-                # if it's got doc comments, use those instead
-                for p in parse(func.__doc__).params:  # type: ignore
-                    params.update({
-                        p.arg_name: {  # type: ignore
-                            'type': parse_type(p.type_name) if p.type_name is not None else 'string',  # type: ignore
-                            'description': p.description,  # type: ignore
-                        }  # type: ignore
-                    })
-
-            def required_params(func):
-                parameters = inspect.signature(func).parameters
-                return [
-                    name for name, param in parameters.items()
-                    if param.default == inspect.Parameter.empty and param.kind != param.VAR_KEYWORD
-                ]
+            # if it's got doc comments, use those instead
+            for p in (doc.params if doc else []):
+                params.update({
+                    p.arg_name: {  # type: ignore
+                        'type': parse_type(p.type_name) if p.type_name is not None else 'string',  # type: ignore
+                        'description': p.description,  # type: ignore
+                    }  # type: ignore
+                })
 
             function = {
                 'name': invoked_by,
@@ -713,18 +768,22 @@ class Helpers():
                     'type': 'object',
                     'properties': params
                 },
-                'required': required_params(func),
+                'required': [
+                    name for name, param in signature.parameters.items()
+                    if param.default == inspect.Parameter.empty and param.kind != param.VAR_KEYWORD
+                ],
             }
             return function
         else:
             # check to see if parameters are specified in the __doc__, often they're not
-            if not parse(func.__doc__).params:
-                parameters = list(inspect.signature(func).parameters.keys())
+            if not doc or not doc.params:
+                parameters = list(signature.parameters.keys())
             else:
-                parameters = [p.arg_name for p in parse(func.__doc__).params]
+                parameters = [p.arg_name for p in doc.params]
 
-            types = [p.__name__ for p in typing.get_type_hints(func).values()]
-            return_type = typing.get_type_hints(func).get('return')
+            type_hints = typing.get_type_hints(func)
+            types = [p.__name__ for p in type_hints.values()]
+            return_type = type_hints.get('return')
 
             return {
                 # todo: refactor this to be name
@@ -741,6 +800,7 @@ class Helpers():
         return (f'{description["invoked_by"]}({", ".join(description["parameters"])})  # {description["description"]}')
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_function_description_flat_extra(function: Callable) -> str:
         description = Helpers.get_function_description(function, openai_format=False)
         parameter_type_list = [f"{param}: {typ}" for param, typ in zip(description['parameters'], description['types'])]
@@ -752,9 +812,16 @@ class Helpers():
         if not prompt_name.endswith('.prompt'):
             prompt_name += '.prompt'
 
+        # the mtime is part of the cache key so edits to a prompt file are picked up without a restart.
+        # callers populate the returned dict in place, so hand out a copy of the cached one
         prompt_file = resources.files(module) / prompt_name
+        prompt = Helpers.__read_prompt(str(prompt_file), os.path.getmtime(str(prompt_file)))
+        return {**prompt, 'templates': list(prompt['templates'])}
 
-        with open(prompt_file, 'r') as f:  # type: ignore
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def __read_prompt(prompt_file: str, mtime: float) -> Dict[str, Any]:
+        with open(prompt_file, 'r') as f:
             prompt = f.read()
 
             if '[system_message]' not in prompt:
@@ -767,10 +834,14 @@ class Helpers():
             user_message = prompt[prompt.find('[user_message]') + len('[user_message]'):].strip()
             templates = []
 
-            temp_prompt = prompt
-            while '{{' and '}}' in temp_prompt:
-                templates.append(Helpers.in_between(temp_prompt, '{{', '}}'))
-                temp_prompt = temp_prompt.split('}}', 1)[-1]
+            # walk the prompt by offset rather than re-slicing the remainder
+            start = prompt.find('{{')
+            while start != -1:
+                end = prompt.find('}}', start + 2)
+                if end == -1:
+                    break
+                templates.append(prompt[start + 2:end])
+                start = prompt.find('{{', end + 2)
 
             return {
                 'system_message': system_message,
@@ -796,9 +867,12 @@ class Helpers():
             template['assistant_token'] = assistant_token
             template['assistant_colon_token'] = assistant_token + ':'
 
-        for key, value in template.items():
-            prompt['system_message'] = prompt['system_message'].replace('{{' + key + '}}', value)
-            prompt['user_message'] = prompt['user_message'].replace('{{' + key + '}}', value)
+        # one pass per message; unknown placeholders are left as-is
+        def substitute(match: re.Match) -> str:
+            return template.get(match.group(1), match.group(0))
+
+        prompt['system_message'] = _TEMPLATE_RE.sub(substitute, prompt['system_message'])
+        prompt['user_message'] = _TEMPLATE_RE.sub(substitute, prompt['user_message'])
 
         prompt['user_message'] += f'{append_token}'
         prompt['prompt_name'] = prompt_name
@@ -2,17 +2,18 @@ import asyncio
 import os
 from typing import Awaitable, Callable, Dict, List, Optional, cast
 
-import tiktoken
 from mistralai.async_client import MistralAsyncClient
 from mistralai.models.chat_completion import ChatMessage
 
+from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Assistant, AstNode, Content, Executor,
-                                  Message, TokenStopNode, User, awaitable_none)
+                                  Message, TokenStopNode, awaitable_none)
 from llmvm.common.perf import TokenPerf, TokenPerfWrapper
 
 logging = setup_logging()
 
+
 class MistralExecutor(Executor):
     def __init__(
         self,
@@ -85,7 +86,6 @@ class MistralExecutor(Executor):
         # obtained from: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
         def num_tokens_from_messages(messages, model: str):
             """Return the number of tokens used by a list of messages."""
-            encoding = tiktoken.get_encoding('cl100k_base')
             if model in {
                 "mistral-tiny",
                 "mistral-small",
@@ -100,18 +100,19 @@ class MistralExecutor(Executor):
                 num_tokens += tokens_per_message
 
                 for _, value in message.items():
-                    num_tokens += len(encoding.encode(value))
+                    num_tokens += Helpers.tiktoken_len(value)
             num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
             return num_tokens
 
         if isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], Message):
             dict_messages = [Message.to_dict(m) for m in messages]  # type: ignore
-            dict_messages.append(Message.to_dict(User(Content(extra_str))))
+            # plain strings don't need to round-trip through User/Content to be counted
+            dict_messages.append({'role': 'user', 'content': extra_str})
             return num_tokens_from_messages(dict_messages, model=model_str)
         elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], dict):
             return num_tokens_from_messages(messages, model=model_str)
         elif isinstance(messages, str):
-            return num_tokens_from_messages([Message.to_dict(User(Content(messages)))], model=model_str)
+            return num_tokens_from_messages([{'role': 'user', 'content': messages}], model=model_str)
         else:
             raise ValueError('cannot calculate tokens for messages: {}'.format(messages))
 
@@ -163,12 +164,6 @@ class MistralExecutor(Executor):
     ) -> Assistant:
         model = model if model else self.default_model
 
-        def last(predicate, iterable):
-            result = [x for x in iterable if predicate(x)]
-            if result:
-                return result[-1]
-            return None
-
         # fresh message list
         messages_list: List[Dict[str, str]] = []
 
@@ -182,13 +177,16 @@ class MistralExecutor(Executor):
             temperature=temperature,
         )
 
-        text_response = ''
+        text_chunks: List[str] = []
         async for chunk in await chat_response:  # type: ignore
             s = chunk.choices[0].delta.content or ''
+            if not s:
+                continue
             await stream_handler(Content(s))
-            text_response += s
+            text_chunks.append(s)
         await stream_handler(TokenStopNode())
 
+        text_response = ''.join(text_chunks)
         messages_list.append({'role': 'assistant', 'content': text_response})
         conversation: List[Message] = [Message.from_dict(m) for m in messages_list]
 
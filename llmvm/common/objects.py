@@ -3,6 +3,7 @@ import copy
 import datetime as dt
 import importlib
 import os
+import re
 from abc import ABC, abstractmethod
 from enum import Enum
 from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
@@ -121,19 +122,25 @@ class Executor(ABC):
     ) -> str:
         pass
 
+_NUMBER_RE = re.compile(r'\s*[-+]?(?:\d+(?:\.\d*)?|\.\d+)\s*')
+
+
+def _is_numeric_str(s: str) -> bool:
+    # plain ascii integers are the common hit, and isascii/isdigit are single C-level scans
+    if s.isascii() and s.isdigit():
+        return True
+    return _NUMBER_RE.fullmatch(s) is not None
+
+
 def coerce_types(a, b):
-    # Function to check if a string can be converted to an integer or a float
-    def is_number(s):
-        try:
-            float(s)
-            return True
-        except ValueError:
-            return False
+    # same (non-string) types are by far the most common case, and need no inspection
+    if type(a) is type(b) and type(a) is not str:
+        return a, b
 
     # If either operand is a string and represents a number, convert it
-    if isinstance(a, str) and is_number(a):
+    if isinstance(a, str) and _is_numeric_str(a):
         a = int(a) if '.' not in a else float(a)
-    if isinstance(b, str) and is_number(b):
+    if isinstance(b, str) and _is_numeric_str(b):
         b = int(b) if '.' not in b else float(b)
 
     # If either operand is a string now, convert both to strings
@@ -181,6 +188,11 @@ def compression_enum(input_str):
 
 
 class LLMCall():
+    __slots__ = (
+        'user_message', 'context_messages', 'executor', 'model', 'temperature',
+        'max_prompt_len', 'completion_tokens_len', 'prompt_name', 'stream_handler',
+    )
+
     def __init__(
         self,
         user_message: 'Message',
@@ -249,6 +261,10 @@ class Controller():
 
 
 class AstNode(ABC):
+    # nodes are allocated per message and per streamed token, so the node hierarchy below
+    # declares __slots__ rather than carrying a per-instance __dict__
+    __slots__ = ()
+
     def __init__(
         self
     ):
@@ -259,6 +275,9 @@ class AstNode(ABC):
 
 
 class TokenStopNode(AstNode):
+    # no __slots__ here or on StopNode: with no slot values to write, jsonpickle falls back to
+    # dir() and emits ABC internals it can't restore, which breaks decoding on the client
+
     def __init__(
         self,
     ):
@@ -285,6 +304,8 @@ class StopNode(AstNode):
 
 
 class StreamNode(AstNode):
+    __slots__ = ('obj', 'type', 'metadata')
+
     def __init__(
         self,
         obj: object,
@@ -304,6 +325,8 @@ class StreamNode(AstNode):
 
 
 class DebugNode(AstNode):
+    __slots__ = ('debug_str',)
+
     def __init__(
         self,
         debug_str: str,
@@ -319,20 +342,25 @@ class DebugNode(AstNode):
 
 
 class Content(AstNode):
+    __slots__ = ('_sequence', '_str_cache', 'content_type', 'url')
+
     def __init__(
         self,
         sequence: Optional[AstNode | List[AstNode] | str | bytes | Any] = None,
         content_type: str = 'text',
         url: str = '',
     ):
-        if sequence is None:
-            self.sequence = ''
-            return
-
         self.content_type = content_type
         self.url = url
 
-        if isinstance(sequence, str):
+        if type(sequence) is str:
+            # the common case (from_dict, executors, tools). the rendered form is the string
+            # itself, so prime the cache rather than joining the one-element list later.
+            self._sequence = [sequence]
+            self._str_cache = sequence
+        elif sequence is None:
+            self.sequence = ''
+        elif isinstance(sequence, str):
             self.sequence = [sequence]
         elif isinstance(sequence, bytes):
             self.sequence = sequence
@@ -340,25 +368,46 @@ class Content(AstNode):
             self.sequence = sequence.sequence  # type: ignore
         elif isinstance(sequence, AstNode):
             self.sequence = [sequence]
-        elif isinstance(sequence, list) and len(sequence) > 0 and isinstance(sequence[0], AstNode):
-            self.sequence = sequence
-        elif (
-            isinstance(sequence, list)
-            and len(sequence) > 0
-            and isinstance(sequence[0], dict)
-            and 'type' in sequence[0]
-            and sequence[0]['type'] == 'image_url'
-        ):
-            base = sequence[0]['image_url']['url'].split(',')[1]
-            self.sequence = base64.b64decode(base)  # bytes
+        elif isinstance(sequence, list):
+            if sequence and isinstance(sequence[0], dict) and sequence[0].get('type') == 'image_url':
+                base = sequence[0]['image_url']['url'].split(',')[1]
+                self.sequence = base64.b64decode(base)  # bytes
+            else:
+                self.sequence = sequence
         else:
             raise ValueError(f'type {type(sequence)} is not supported')
 
+    @property
+    def sequence(self) -> Any:
+        return self._sequence
+
+    @sequence.setter
+    def sequence(self, value: Any) -> None:
+        self._sequence = value
+        self._str_cache: Optional[str] = None
+
+    def __getstate__(self):
+        # the rendered string is derived state, keep it out of pickles and jsonpickle'd stream payloads
+        return {
+            'sequence': self._sequence,
+            'content_type': getattr(self, 'content_type', 'text'),
+            'url': getattr(self, 'url', ''),
+        }
+
+    def __setstate__(self, state):
+        self.sequence = state['sequence']
+        self.content_type = state['content_type']
+        self.url = state['url']
+
     def __str__(self):
-        if isinstance(self.sequence, list):
-            return ' '.join([str(n) for n in self.sequence])
-        else:
-            return str(self.sequence)
+        # content is rendered every time a message is sent to an executor, counted or logged, so
+        # render once. assigning to sequence clears the cache.
+        if self._str_cache is None:
+            if isinstance(self._sequence, list):
+                self._str_cache = ' '.join(str(n) for n in self._sequence)
+            else:
+                self._str_cache = str(self._sequence)
+        return self._str_cache
 
     def __repr__(self):
         return f'Content({self.sequence})'
@@ -380,6 +429,8 @@ class Content(AstNode):
 
 
 class ImageContent(Content):
+    __slots__ = ()
+
     def __init__(
         self,
         sequence: bytes,
@@ -390,6 +441,8 @@ class ImageContent(Content):
 
 
 class PdfContent(Content):
+    __slots__ = ()
+
     def __init__(
         self,
         sequence: bytes | str,
@@ -431,6 +484,8 @@ class PdfContent(Content):
 
 
 class FileContent(Content):
+    __slots__ = ()
+
     def __init__(
         self,
         sequence: bytes,
@@ -454,6 +509,8 @@ class FileContent(Content):
 
 
 class Message(AstNode):
+    __slots__ = ('message',)
+
     def __init__(
         self,
         message: Content,
@@ -474,7 +531,7 @@ class Message(AstNode):
         url = message['url'] if 'url' in message else ''
         content_type = message['content_type'] if 'content_type' in message else ''
 
-        content = Content(message_content)
+        content: Content
 
         # when converting from MessageModel, there can be an embedded image
         # in the content parameter that needs to be converted back to bytes
@@ -503,14 +560,13 @@ class Message(AstNode):
             # else, it's been transferred from the client to server via b64
             else:
                 content = FileContent(FileContent.decode(str(message_content)), url)
+        else:
+            content = Content(message_content)
 
-        if role == 'user':
-            return User(content)
-        elif role == 'system':
-            return System(content)
-        elif role == 'assistant':
-            return Assistant(content)
-        raise ValueError(f'role not found or not supported: {message}')
+        ctor = _ROLE_CTORS.get(role)
+        if not ctor:
+            raise ValueError(f'role not found or not supported: {message}')
+        return ctor(content)
 
     def __getitem__(self, key):
         return {'role': self.role(), 'content': self.message}
@@ -558,6 +614,8 @@ class Message(AstNode):
 
 
 class User(Message):
+    __slots__ = ()
+
     def __init__(
         self,
         message: Content
@@ -574,16 +632,23 @@ class User(Message):
         return f'Message({self.message})'
 
 
-class System(Message):
-    def __init__(
-        self,
-        message: Content = Content('''
+_DEFAULT_SYSTEM_PROMPT = '''
             You are a helpful assistant.
             Dont make assumptions about what values to plug into functions.
             Ask for clarification if a user request is ambiguous.
-        ''')
+        '''
+
+
+class System(Message):
+    __slots__ = ()
+
+    def __init__(
+        self,
+        message: Content | str = _DEFAULT_SYSTEM_PROMPT,
     ):
-        super().__init__(Content(message))
+        # only wrap raw strings (including the default, so each System gets its own Content);
+        # re-wrapping a Content just copies it
+        super().__init__(message if isinstance(message, Content) else Content(message))
 
     def role(self) -> str:
         return 'system'
@@ -596,19 +661,21 @@ class System(Message):
 
 
 class Assistant(Message):
+    __slots__ = ('error', '_llm_call_context', '_system_context', '_messages_context')
+
     def __init__(
         self,
         message: Content,
         error: bool = False,
-        messages_context: List[Message] = [],
+        messages_context: Optional[List[Message]] = None,
         system_context: object = None,
         llm_call_context: object = None,
     ):
         super().__init__(message)
         self.error = error
         self._llm_call_context: object = llm_call_context
-        self._system_context = system_context,
-        self._messages_context: List[Message] = messages_context
+        self._system_context = system_context
+        self._messages_context: List[Message] = messages_context if messages_context is not None else []
 
     def role(self) -> str:
         return 'assistant'
@@ -631,7 +698,16 @@ class Assistant(Message):
         return f'Assistant({self.message} {self.error})'
 
 
+_ROLE_CTORS: Dict[str, Callable[[Content], Message]] = {
+    'user': User,
+    'system': System,
+    'assistant': Assistant,
+}
+
+
 class Statement(AstNode):
+    __slots__ = ('_result', '_ast_text')
+
     def __init__(
         self,
         ast_text: Optional[str] = None,
@@ -653,6 +729,8 @@ class Statement(AstNode):
 
 
 class DataFrame(Statement):
+    __slots__ = ('elements',)
+
     def __init__(
         self,
         elements: List,
@@ -666,6 +744,8 @@ class DataFrame(Statement):
 
 
 class Call(Statement):
+    __slots__ = ()
+
     def __init__(
         self,
         ast_text: Optional[str] = None,
@@ -674,6 +754,8 @@ class Call(Statement):
 
 
 class FunctionCallMeta(Call):
+    __slots__ = ('callsite', 'func', 'lineno', '_str_cache')
+
     def __init__(
         self,
         callsite: str,
@@ -685,6 +767,7 @@ class FunctionCallMeta(Call):
         self.func = func
         self._result = result
         self.lineno = lineno
+        self._str_cache: Optional[str] = None
 
     def result(self) -> object:
         return self._result
@@ -693,10 +776,20 @@ class FunctionCallMeta(Call):
         return 'functioncallmeta'
 
     def __getattr__(self, name):
+        # an unset slot lands here too; don't recurse into ourselves looking for _result
+        if name == '_result':
+            raise AttributeError(name)
         return getattr(self._result, name)
 
     def __str__(self):
-        return str(self._result)
+        if self._str_cache is not None:
+            return self._str_cache
+        rendered = str(self._result)
+        # only immutable results can be cached: lists and DataFrames can change in place through
+        # result() or any other reference, which this object would never see
+        if isinstance(self._result, (str, int, float, bool)):
+            self._str_cache = rendered
+        return rendered
 
     def __add__(self, other):
         a, b = coerce_types(self._result, other)
@@ -775,6 +868,8 @@ class FunctionCallMeta(Call):
         return format(self._result, format_spec)
 
 class PandasMeta(Call):
+    __slots__ = ('expr_str', 'df')
+
     def __init__(
         self,
         expr_str: str,
@@ -798,12 +893,14 @@ class PandasMeta(Call):
 
 
 class FunctionCall(Call):
+    __slots__ = ('name', 'args', 'types', 'context', 'func')
+
     def __init__(
         self,
         name: str,
         args: List[Dict[str, object]],
         types: List[Dict[str, object]],
-        context: Content = Content(),
+        context: Optional[Content] = None,
         func: Optional[Callable] = None,
         ast_text: Optional[str] = None,
     ):
@@ -811,7 +908,7 @@ class FunctionCall(Call):
         self.name = name
         self.args = args
         self.types = types
-        self.context = context
+        self.context = context if context is not None else Content()
         self._result: Optional[Content] = None
         self.func: Optional[Callable] = func
 
@@ -837,15 +934,17 @@ class FunctionCall(Call):
         return 'function_call'
 
 class Answer(Statement):
+    __slots__ = ('conversation', 'error')
+
     def __init__(
         self,
-        conversation: List[Message] = [],
+        conversation: Optional[List[Message]] = None,
         result: object = None,
         error: object = None,
         ast_text: Optional[str] = None,
     ):
         super().__init__(ast_text)
-        self.conversation: List[Message] = conversation
+        self.conversation: List[Message] = conversation if conversation is not None else []
         self._result = result
         self.error = error
 
@@ -861,16 +960,18 @@ class Answer(Statement):
 
 
 class UncertainOrError(Statement):
+    __slots__ = ('error_message', 'supporting_conversation', 'supporting_error')
+
     def __init__(
         self,
         error_message: Content,
-        supporting_conversation: List[AstNode] = [],
+        supporting_conversation: Optional[List[AstNode]] = None,
         supporting_result: object = None,
         supporting_error: object = None,
     ):
         super().__init__()
         self.error_message = error_message,
-        self.supporting_conversation = supporting_conversation
+        self.supporting_conversation = supporting_conversation if supporting_conversation is not None else []
         self._result = supporting_result
         self.supporting_error = supporting_error
 
@@ -896,11 +997,18 @@ class MessageModel(BaseModel):
     url: Optional[str] = None
 
     def to_message(self) -> Message:
-        return Message.from_dict(self.model_dump())
+        # from_dict only reads these four keys, so skip building (and deep copying) a full model_dump()
+        return Message.from_dict({
+            'role': self.role,
+            'content': self.content,
+            'content_type': self.content_type,
+            'url': self.url,
+        })
 
     @staticmethod
     def from_message(message: Message) -> 'MessageModel':
-        return MessageModel(**Message.to_dict(message, server_serialization=True))
+        # to_dict(server_serialization=True) already produces exactly the model's fields, so skip re-validating them
+        return MessageModel.model_construct(**Message.to_dict(message, server_serialization=True))
 
 
 class SessionThread(BaseModel):
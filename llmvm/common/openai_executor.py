@@ -4,21 +4,22 @@ import os
 from io import BytesIO
 from typing import Awaitable, Callable, Dict, List, Optional, cast
 
-import tiktoken
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 from openai.types.chat.completion_create_params import Function
 from PIL import Image
 
+from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Assistant, AstNode, Content, Executor,
-                                  Message, System, TokenStopNode, User,
+                                  Message, System, TokenStopNode,
                                   awaitable_none)
 from llmvm.common.perf import TokenPerf, TokenPerfWrapper
 
 logging = setup_logging()
 aclient = AsyncOpenAI()
 
+
 class OpenAIExecutor(Executor):
     def __init__(
         self,
@@ -112,7 +113,6 @@ class OpenAIExecutor(Executor):
         # obtained from: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
         def num_tokens_from_messages(messages, model: str):
             """Return the number of tokens used by a list of messages."""
-            encoding = tiktoken.get_encoding('cl100k_base')
             if model in {
                 "gpt-3.5-turbo-0613",
                 "gpt-3.5-turbo-16k-0613",
@@ -155,7 +155,7 @@ class OpenAIExecutor(Executor):
                                 else:
                                     num_tokens += 85
                     else:
-                        num_tokens += len(encoding.encode(value))
+                        num_tokens += Helpers.tiktoken_len(value)
                         if key == "name":
                             num_tokens += tokens_per_name
             num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
@@ -163,12 +163,13 @@ class OpenAIExecutor(Executor):
 
         if isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], Message):
             dict_messages = [Message.to_dict(m) for m in messages]  # type: ignore
-            dict_messages.append(Message.to_dict(User(Content(extra_str))))
+            # plain strings don't need to round-trip through User/Content to be counted
+            dict_messages.append({'role': 'user', 'content': extra_str})
             return num_tokens_from_messages(dict_messages, model=model_str)
         elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], dict):
             return num_tokens_from_messages(messages, model=model_str)
         elif isinstance(messages, str):
-            return num_tokens_from_messages([Message.to_dict(User(Content(messages)))], model=model_str)
+            return num_tokens_from_messages([{'role': 'user', 'content': messages}], model=model_str)
         else:
             raise ValueError('cannot calculate tokens for messages: {}'.format(messages))
 
@@ -232,10 +233,7 @@ class OpenAIExecutor(Executor):
         model = model if model else self.default_model
 
         def last(predicate, iterable):
-            result = [x for x in iterable if predicate(x)]
-            if result:
-                return result[-1]
-            return None
+            return next((x for x in reversed(iterable) if predicate(x)), None)
 
         # find the system message and append to the front
         system_message = last(lambda x: x.role() == 'system', messages)
@@ -257,13 +255,17 @@ class OpenAIExecutor(Executor):
             temperature=temperature,
         )
 
-        text_response = ''
+        # collect the streamed deltas and join once at the end, rather than re-copying the string per token
+        text_chunks: List[str] = []
         async for chunk in await chat_response:  # type: ignore
             s = chunk.choices[0].delta.content or ''
+            if not s:
+                continue
             await stream_handler(Content(s))
-            text_response += s
+            text_chunks.append(s)
         await stream_handler(TokenStopNode())
 
+        text_response = ''.join(text_chunks)
         messages_list.append({'role': 'assistant', 'content': text_response})
         conversation: List[Message] = [Message.from_dict(m) for m in messages_list]
 
@@ -31,6 +31,15 @@ class Parser():
         self.agents: List[Callable] = []
         self.errors: List[UncertainOrError] = []
 
+    @property
+    def agents(self) -> List[Callable]:
+        return self._agents
+
+    @agents.setter
+    def agents(self, agents: List[Callable]):
+        self._agents = agents
+        self._agents_by_name: Dict[str, Callable] = {f.__name__.lower(): f for f in reversed(agents)}
+
     def __parse_string(
         self,
     ) -> Optional[str]:
@@ -86,20 +95,19 @@ class Parser():
             function_args.append(token.strip())
 
         # function_args = [p.strip() for p in Helpers.in_between(call, '(', ')').split(',')]
-        func = functions[0]
-
-        for f in functions:
-            if f.__name__.lower() in function_name.lower():
-                function_description = Helpers.get_function_description(
-                    f,
-                    openai_format=True
-                )
-                func = f
-                break
-
-        if not function_description:
+        # exact name match first (the callsite may be qualified, e.g. WebHelpers.get_url)
+        func = None
+        if functions is self._agents:
+            func = self._agents_by_name.get(function_name.rsplit('.', 1)[-1].lower())
+
+        if not func:
+            func = Helpers.first(lambda f: f.__name__.lower() in function_name.lower(), functions)
+
+        if not func:
             return None
 
+        function_description = Helpers.get_function_description(func, openai_format=True)
+
         argument_count = 0
 
         for _, parameter in function_description['parameters']['properties'].items():
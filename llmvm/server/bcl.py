@@ -6,7 +6,9 @@ import datetime as dt
 import re
 import time
 import os
+from collections import deque
 from datetime import timedelta
+from itertools import islice
 from typing import Any, Callable, Dict, Generator, List, Optional, cast
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
@@ -34,6 +36,11 @@ from llmvm.server.tools.gmail import GmailSearcher
 
 logging = setup_logging()
 
+_QUERY_LIST_RE = re.compile(r'\[\s*("(?:\\.|[^"\\])*"\s*,\s*)*"(?:\\.|[^"\\])*"\s*\]')
+_RANK_LIST_RE = re.compile(r'\[\s*(-?\d+\s*,\s*)*-?\d+\s*\]')
+# one pass for either fence type, rather than an 'in' check plus a search per language
+_CODE_FENCE_RE = re.compile(r'```(python|starlark)([\s\S]*?)```')
+
 class BCL():
     @staticmethod
     def __last_day_of_quarter(year, quarter):
@@ -284,8 +291,7 @@ class Searcher():
             logging.debug("search() trying again with regex list extractor")
 
             # try and extract a list
-            pattern = r'\[\s*("(?:\\.|[^"\\])*"\s*,\s*)*"(?:\\.|[^"\\])*"\s*\]'
-            match = re.search(pattern, str(query_expander.message))
+            match = _QUERY_LIST_RE.search(str(query_expander.message))
 
             if match:
                 try:
@@ -488,8 +494,7 @@ class Searcher():
             ranked_results = eval(str(result_rank.message))
         except SyntaxError as ex:
             logging.debug(f"SyntaxError: {ex}")
-            pattern = r'\[\s*(-?\d+\s*,\s*)*-?\d+\s*\]'
-            match = re.search(pattern, str(result_rank.message))
+            match = _RANK_LIST_RE.search(str(result_rank.message))
 
             if match:
                 try:
@@ -593,7 +598,8 @@ class FunctionBindable():
     ) -> Generator['FunctionBindable', None, None]:
         bound = False
         global_counter = 0
-        messages: List[Message] = []
+        # new prompts are pushed onto the front while the binder retries, so use a deque
+        messages: deque[Message] = deque()
         extra: List[str] = []
         goal = ''
         bindable = ''
@@ -665,6 +671,9 @@ class FunctionBindable():
         counter = 3  # we start at 3 because we've already added the system, expr and the function definition prompt
         assistant_counter = 0
 
+        parser = Parser()
+        parser.agents = self.agents
+
         while global_counter < 3:
             # try and bind the callsite without executing
             while not bound and counter < 8:
@@ -672,7 +681,7 @@ class FunctionBindable():
                 llm_bind_result = self.starlark_runtime.controller.execute_llm_call(
                     llm_call=LLMCall(
                         user_message=User(Content()),  # we can pass an empty message here and the context_messages contain everything  # noqa:E501
-                        context_messages=messages[:counter + assistant_counter][::-1],  # reversing the list using list slicing
+                        context_messages=list(islice(messages, counter + assistant_counter))[::-1],
                         executor=self.starlark_runtime.controller.get_executor(),
                         model=self.starlark_runtime.controller.get_executor().get_default_model(),
                         temperature=0.0,
@@ -691,19 +700,11 @@ class FunctionBindable():
                 if 'def ' in bindable:
                     bindable = bindable.replace('def ', '')
 
-                if '```python' in bindable:
-                    match = re.search(r'```python([\s\S]*?)```', bindable)
-                    if match:
-                        bindable = match.group(1).replace('python', '').strip()
-
-                if '```starlark' in bindable:
-                    match = re.search(r'```starlark([\s\S]*?)```', bindable)
-                    if match:
-                        bindable = match.group(1).replace('starlark', '').strip()
+                match = _CODE_FENCE_RE.search(bindable)
+                if match:
+                    bindable = match.group(2).replace(match.group(1), '').strip()
 
                 # get function definition
-                parser = Parser()
-                parser.agents = self.agents
                 function_call = parser.get_callsite(bindable)
 
                 if 'None' in str(bindable):
@@ -719,10 +720,10 @@ class FunctionBindable():
                         Using the data found in previous messages, answer the question "{question}", and then bind the callsite
                         using the same reply rules as in previous messages. Reply with only Starlark code.
                         '''
-                        messages.insert(0, User(Content(prompt)))
+                        messages.appendleft(User(Content(prompt)))
                     else:
                         # todo figure this out
-                        messages.insert(0, Assistant(message=Content(bindable)))
+                        messages.appendleft(Assistant(message=Content(bindable)))
                     if counter > len(messages) - assistant_counter:
                         # we've run out of messages, so we'll just use the original code
                         break
@@ -731,8 +732,8 @@ class FunctionBindable():
                     break
                 else:
                     # no function_call result, so bump the counter
-                    messages.insert(0, Assistant(message=Content(bindable)))
-                    messages.insert(0, User(message=Content(
+                    messages.appendleft(Assistant(message=Content(bindable)))
+                    messages.appendleft(User(message=Content(
                         """Please try harder to bind the callsite.
                         Look thoroughly through the previous messages for data and then reply with your best guess at the bounded
                         callsite. Reply only with Starlark code that can be parsed by the Starlark compiler.
@@ -1,4 +1,7 @@
 import os
+import tempfile
+import threading
+from typing import Optional
 
 import dill
 
@@ -8,13 +11,27 @@ class PersistentCache:
     def __init__(self, filename: str):
         self.filename = filename
         self.cache = {}
+        self._loaded = False
+        # dill.dumps of the same int/str keys on every lookup adds up; remember the serialized form
+        self._serialized_keys = {}
 
         if not os.path.isfile(self.filename):
             with open(self.filename, 'wb') as f:
                 dill.dump({}, f)
 
     def _serialize_key(self, key):
-        return dill.dumps(key)
+        # keyed on type as well so 1 and True don't share an entry
+        memo_key = (type(key), key)
+        try:
+            serialized_key = self._serialized_keys.get(memo_key)
+        except TypeError:
+            # unhashable key
+            return dill.dumps(key)
+
+        if serialized_key is None:
+            serialized_key = dill.dumps(key)
+            self._serialized_keys[memo_key] = serialized_key
+        return serialized_key
 
     def _deserialize_key(self, serialized_key):
         return dill.loads(serialized_key)
@@ -24,9 +41,12 @@ class PersistentCache:
             with open(self.filename, 'wb') as f:
                 dill.dump({}, f)
 
-        if not self.cache:
+        # an empty cache is a valid loaded state, so track loading explicitly rather than re-reading
+        # the file on every call until something gets stored
+        if not self._loaded:
             with open(self.filename, 'rb') as f:
                 self.cache = dill.load(f)
+            self._loaded = True
 
     def set(self, key, value):
         self.setup()
@@ -36,9 +56,9 @@ class PersistentCache:
         with open(self.filename, 'rb+') as f:
             dill.dump(self.cache, f)
 
-    def get(self, key):
+    def get(self, key, default=None):
         self.setup()
-        return self.cache.get(self._serialize_key(key))
+        return self.cache.get(self._serialize_key(key), default)
 
     def delete(self, key):
         self.setup()
@@ -58,6 +78,88 @@ class PersistentCache:
         self.setup()
         return [self._deserialize_key(k) for k in self.cache.keys()]
 
+    def values(self):
+        self.setup()
+        return list(self.cache.values())
+
     def gen_key(self):
         keys = self.keys()
         return keys[-1] + 1 if keys else 1
+
+
+class DirectoryCache:
+    # one file per entry, so a write costs the size of that entry rather than re-dumping
+    # everything, and the least recently used entries are evicted once max_entries is exceeded.
+    # keys must be filename safe (callers use hex digests).
+    def __init__(self, directory: str, max_entries: int = 10000):
+        self.directory = directory
+        self.max_entries = max(1, max_entries)
+        os.makedirs(self.directory, exist_ok=True)
+        # set_bytes() is called from worker threads
+        self._lock = threading.Lock()
+        self._count = len(self.__entries())
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __entries(self):
+        # in-flight writes are .tmp files owned by another thread, leave them alone
+        return [entry for entry in os.scandir(self.directory) if not entry.name.endswith('.tmp')]
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # touch on read so eviction drops the least recently used entries
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def set_bytes(self, key: str, data: bytes) -> None:
+        path = self.__path(key)
+        exists = os.path.isfile(path)
+        # write to a unique temp file then rename, so concurrent writers of the same key
+        # don't collide and a reader never sees a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        if not exists:
+            with self._lock:
+                self._count += 1
+                if self._count > self.max_entries:
+                    self.__evict()
+
+    def __evict(self) -> None:
+        entries = []
+        for entry in self.__entries():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+
+        # trim down to 90% so eviction isn't rerun on every subsequent write
+        excess = max(0, len(entries) - int(self.max_entries * 0.9))
+        for _, path in entries[:excess]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._count = len(entries) - excess
+
+
+class ResponseCache(DirectoryCache):
+    def get(self, key: str, default=None):
+        data = self.get_bytes(key)
+        return data.decode('utf-8') if data is not None else default
+
+    def set(self, key: str, value: str) -> None:
+        self.set_bytes(key, value.encode('utf-8'))
@@ -2,22 +2,23 @@ import asyncio
 import os
 import shutil
 import sys
-from typing import List, Optional, cast
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, List, Optional, cast
 
 import async_timeout
 import jsonpickle
 import nest_asyncio
-from openai import AsyncOpenAI, OpenAI
+import orjson
+from openai import AsyncOpenAI
 
-client = OpenAI()
 aclient = AsyncOpenAI()
 
 from importlib import resources
 
 import rich
 import uvicorn
-from fastapi import (BackgroundTasks, FastAPI, HTTPException, Request,
-                     UploadFile)
+from fastapi import FastAPI, HTTPException, Request, UploadFile
 from fastapi.param_functions import File, Form
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
@@ -30,21 +31,65 @@ from llmvm.common.mistral_executor import MistralExecutor
 from llmvm.common.objects import (Answer, Assistant, AstNode, Content,
                                   DownloadItem, FileContent, MessageModel,
                                   SessionThread, Statement, StopNode,
-                                  TokenCompressionMethod, User,
+                                  TokenCompressionMethod, TokenStopNode, User,
                                   compression_enum)
 from llmvm.common.openai_executor import OpenAIExecutor
-from llmvm.server.persistent_cache import PersistentCache
+from llmvm.server.persistent_cache import PersistentCache, ResponseCache
 from llmvm.server.starlark_execution_controller import \
     StarlarkExecutionController
 from llmvm.server.tools.firefox import FirefoxHelpers
 from llmvm.server.vector_search import VectorSearch
 from llmvm.server.vector_store import VectorStore
 
+# starlark programs run synchronously inside the request's event loop and call back into
+# async code (execute_llm_call, helpers, firefox) via asyncio.run/run_until_complete,
+# so the loop has to be re-entrant until the runtime itself is async.
 nest_asyncio.apply()
 
 logging = setup_logging()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the vector store loads the faiss index and embedding model, so build it once per worker
+    # at startup rather than as an import side effect
+    vector_store = VectorStore(
+        store_directory=Container().get('vector_store_index_directory'),
+        index_name='index',
+        embedding_model=Container().get('vector_store_embedding_model'),
+        chunk_size=int(Container().get('vector_store_chunk_size')),
+        chunk_overlap=10,
+        index_type=Container().get('vector_store_index_type', 'flat'),
+        chunk_cache_max_entries=int(Container().get('vector_store_chunk_cache_max_entries', 1000)),
+    )
+    app.state.vector_search = VectorSearch(vector_store=vector_store)
+
+    # ingestion (chunking + embedding) is slow and synchronous, so run it on worker threads
+    # fed from a queue rather than as BackgroundTasks on the event loop
+    app.state.ingest_queue = asyncio.Queue()
+    workers = [
+        asyncio.create_task(ingest_worker(app.state.ingest_queue))
+        for _ in range(max(1, int(Container().get('vector_store_ingest_workers', 1))))
+    ]
+    yield
+
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def ingest_worker(queue: asyncio.Queue):
+    while True:
+        func, args = await queue.get()
+        try:
+            await asyncio.to_thread(func, *args)
+        except Exception as e:
+            logging.error(f'ingest_worker() failed: {e}')
+        finally:
+            queue.task_done()
+
+
+app = FastAPI(lifespan=lifespan)
 
 agents = list(
     filter(
@@ -60,6 +105,15 @@ os.makedirs(Container().get('log_directory'), exist_ok=True)
 os.makedirs(Container().get('vector_store_index_directory'), exist_ok=True)
 
 cache_session = PersistentCache(Container().get('cache_directory') + '/session.cache')
+# opt-in replay of temperature 0 llm calls, keyed on the exact prompt
+response_cache = (
+    ResponseCache(
+        Container().get('cache_directory') + '/llm_response',
+        max_entries=int(Container().get('llm_response_cache_max_entries', 10000)),
+    )
+    if Container().get_config_variable('llm_response_cache', 'LLMVM_LLM_RESPONSE_CACHE', default=False)
+    else None
+)
 cdn_directory = Container().get('cdn_directory')
 
 
@@ -68,15 +122,6 @@ if not os.environ.get('OPENAI_API_KEY') and not os.environ.get('ANTHROPIC_API_KE
     sys.exit(1)
 
 
-vector_store = VectorStore(
-    store_directory=Container().get('vector_store_index_directory'),
-    index_name='index',
-    embedding_model=Container().get('vector_store_embedding_model'),
-    chunk_size=int(Container().get('vector_store_chunk_size')),
-    chunk_overlap=10
-)
-vector_search = VectorSearch(vector_store=vector_store)
-
 
 def get_controller(controller: Optional[str] = None) -> StarlarkExecutionController:
     if not controller:
@@ -95,9 +140,11 @@ def get_controller(controller: Optional[str] = None) -> StarlarkExecutionControl
         anthropic_controller = StarlarkExecutionController(
             executor=anthropic_executor,
             agents=agents,  # type: ignore
-            vector_search=vector_search,
+            vector_search=app.state.vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            map_reduce_concurrency=int(Container().get('map_reduce_concurrency', 4)),
+            response_cache=response_cache,
         )
         return anthropic_controller
     elif controller == 'mistral':
@@ -109,9 +156,11 @@ def get_controller(controller: Optional[str] = None) -> StarlarkExecutionControl
         mistral_controller = StarlarkExecutionController(
             executor=mistral_executor,
             agents=agents,  # type: ignore
-            vector_search=vector_search,
+            vector_search=app.state.vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            map_reduce_concurrency=int(Container().get('map_reduce_concurrency', 4)),
+            response_cache=response_cache,
         )
         return mistral_controller
     elif controller == 'gemini':
@@ -123,9 +172,11 @@ def get_controller(controller: Optional[str] = None) -> StarlarkExecutionControl
         gemini_controller = StarlarkExecutionController(
             executor=gemini_executor,
             agents=agents,  # type: ignore
-            vector_search=vector_search,
+            vector_search=app.state.vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            map_reduce_concurrency=int(Container().get('map_reduce_concurrency', 4)),
+            response_cache=response_cache,
         )
         return gemini_controller
     else:
@@ -139,28 +190,68 @@ def get_controller(controller: Optional[str] = None) -> StarlarkExecutionControl
         openai_controller = StarlarkExecutionController(
             executor=openai_executor,
             agents=agents,  # type: ignore
-            vector_search=vector_search,
+            vector_search=app.state.vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            map_reduce_concurrency=int(Container().get('map_reduce_concurrency', 4)),
+            response_cache=response_cache,
         )
         return openai_controller
 
 
+class TokenQueue():
+    # single consumer token buffer for the streaming endpoints. tokens arrive faster than the SSE
+    # consumer wakes up, so drain everything buffered per wake-up rather than a future per token
+    def __init__(self):
+        self.buffer: Deque[AstNode] = deque()
+        self.event = asyncio.Event()
+
+    def put_nowait(self, token: AstNode):
+        self.buffer.append(token)
+        self.event.set()
+
+    async def drain(self) -> AsyncIterator[AstNode]:
+        while True:
+            await self.event.wait()
+            self.event.clear()
+            while self.buffer:
+                token = self.buffer.popleft()
+                if isinstance(token, StopNode):
+                    return
+                yield token
+
+
 def __get_thread(id: int) -> SessionThread:
-    if not cache_session.has_key(id) or id <= 0:
+    thread = cache_session.get(id) if id > 0 else None
+    if thread is None:
         id = cache_session.gen_key()
         thread = SessionThread(current_mode='tool', id=id)
         cache_session.set(thread.id, thread)
-    return cast(SessionThread, cache_session.get(id))
+    return cast(SessionThread, thread)
+
+
+_CONTENT_PY_OBJECT = f'{Content.__module__}.{Content.__qualname__}'
+_TOKEN_STOP_EVENT = f'data: {jsonpickle.encode(TokenStopNode())}\n\n'.encode('utf-8')
+
+
+def encode_stream_chunk(chunk) -> bytes | str:
+    # streamed tokens are by far the most common chunk, so encode them with orjson in the same
+    # shape jsonpickle produces (the client decodes with jsonpickle). everything else falls back.
+    if type(chunk) is Content:
+        state = chunk.__getstate__()
+        sequence = state['sequence']
+        if isinstance(sequence, list) and all(type(s) is str for s in sequence):
+            return b'data: ' + orjson.dumps({'py/object': _CONTENT_PY_OBJECT, 'py/state': state}) + b'\n\n'
+    elif type(chunk) is TokenStopNode:
+        return _TOKEN_STOP_EVENT
+    return f"data: {jsonpickle.encode(chunk)}\n\n"
 
 
 async def stream_response(response):
-    content = ''
     async with async_timeout.timeout(220):
         try:
             async for chunk in response:
-                content += str(chunk)
-                yield f"data: {jsonpickle.encode(chunk)}\n\n"
+                yield encode_stream_chunk(chunk)
             yield "data: [DONE]"
         except asyncio.TimeoutError:
             raise HTTPException(status_code=504, detail="Stream timed out")
@@ -169,14 +260,9 @@ async def stream_response(response):
 @app.post('/v1/chat/completions')
 async def chat_completions(request: Request):
     try:
-        # Construct the prompt from the messages
-        data = await request.json()
+        data = orjson.loads(await request.body())
         messages = data.get('messages', [])
-        prompt = ""
-        for msg in messages:
-            prompt += f'{msg["role"]}: {msg["content"]}\n'
 
-        # Get the JSON body of the request
         if 'stream' in data and data['stream']:
             response = await aclient.chat.completions.create(
                 model=data['model'],
@@ -187,7 +273,7 @@ async def chat_completions(request: Request):
             )
             return StreamingResponse(stream_response(response), media_type='text/event-stream')  # media_type="application/json")
         else:
-            response = client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model=data['model'],
                 temperature=0.0,
                 max_tokens=150,
@@ -207,23 +293,21 @@ def get_file(filename: str):
 
 @app.get('/search/{query}')
 def search(query: str):
-    results = vector_search.search(query, max_results=10, min_score=0.7)
+    results = app.state.vector_search.search(query, max_results=10, min_score=0.7)
     return results
 
 @app.post('/ingest')
-async def ingest(file: UploadFile = File(...), background_tasks: BackgroundTasks = BackgroundTasks()):
+async def ingest(file: UploadFile = File(...)):
     try:
         name = os.path.basename(str(file.filename))
 
         with open(f"{cdn_directory}/{name}", "wb") as buffer:
-            buffer.write(file.file.read())
-            background_tasks.add_task(
-                vector_search.ingest_file,
-                f"{cdn_directory}/{name}",
-                '',
-                str(file.filename),
-                {}
-            )
+            # copy in chunks on a worker thread, so large uploads neither sit in memory nor block the loop
+            await asyncio.to_thread(shutil.copyfileobj, file.file, buffer, 1 << 20)
+        app.state.ingest_queue.put_nowait((
+            app.state.vector_search.ingest_file,
+            (f"{cdn_directory}/{name}", '', str(file.filename), {}),
+        ))
         return {"filename": file.filename, "detail": "Ingestion started."}
 
     except Exception as e:
@@ -232,15 +316,11 @@ async def ingest(file: UploadFile = File(...), background_tasks: BackgroundTasks
 @app.post('/download')
 async def download(
     download_item: DownloadItem,
-    background_tasks: BackgroundTasks = BackgroundTasks()
 ):
+    # __get_thread always hands back a stored thread with a valid id
     thread = __get_thread(download_item.id)
 
-    if not cache_session.has_key(thread.id) or thread.id <= 0:
-        temp = __get_thread(0)
-        thread.id = temp.id
-
-    queue = asyncio.Queue()
+    queue = TokenQueue()
 
     async def callback(token: AstNode):
         queue.put_nowait(token)
@@ -261,21 +341,15 @@ async def download(
             queue.put_nowait(StopNode())
 
             if content:
-                background_tasks.add_task(
-                    vector_search.ingest_text,
-                    content,
-                    content[:25],
-                    download_item.url,
-                    {}
-                )
+                app.state.ingest_queue.put_nowait((
+                    app.state.vector_search.ingest_text,
+                    (content, content[:25], download_item.url, {}),
+                ))
             return content
 
         task = asyncio.create_task(execute_and_signal())
 
-        while True:
-            data = await queue.get()
-            if isinstance(data, StopNode):
-                break
+        async for data in queue.drain():
             yield data
 
         await task
@@ -297,17 +371,16 @@ async def get_thread(id: int) -> SessionThread:
 async def set_thread(request: SessionThread) -> SessionThread:
     thread = request
 
-    if not cache_session.has_key(thread.id) or thread.id <= 0:
+    if thread.id <= 0 or not cache_session.has_key(thread.id):
         temp = __get_thread(0)
         thread.id = temp.id
 
     cache_session.set(thread.id, thread)
-    return cast(SessionThread, cache_session.get(thread.id))
+    return thread
 
 @app.get('/v1/chat/get_threads')
 async def get_threads() -> List[SessionThread]:
-    result = [cast(SessionThread, cache_session.get(id)) for id in cache_session.keys()]
-    return result
+    return cast(List[SessionThread], cache_session.values())
 
 @app.get('v1/chat/clear_threads')
 async def clear_threads() -> None:
@@ -372,13 +445,13 @@ async def code_completions(request: SessionThread):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Exception: {e}")
 
-    if not cache_session.has_key(thread.id) or thread.id <= 0:
+    if thread.id <= 0 or not cache_session.has_key(thread.id):
         temp = __get_thread(0)
         thread.id = temp.id
 
     mode = thread.current_mode
     compression = compression_enum(thread.compression)
-    queue = asyncio.Queue()
+    queue = TokenQueue()
 
     # set the defaults, or use what the SessionThread thread asks
     if thread.executor and thread.model:
@@ -423,10 +496,7 @@ async def code_completions(request: SessionThread):
         task = asyncio.create_task(execute_and_signal())
         task.add_done_callback(handle_exception)
 
-        while True:
-            data = await queue.get()
-            if isinstance(data, StopNode):
-                break
+        async for data in queue.drain():
             yield data
 
         try:
@@ -466,14 +536,14 @@ async def code_completions(request: SessionThread):
 async def tools_completions(request: SessionThread):
     thread = request
 
-    if not cache_session.has_key(thread.id) or thread.id <= 0:
+    if thread.id <= 0 or not cache_session.has_key(thread.id):
         temp = __get_thread(0)
         thread.id = temp.id
 
     messages = [MessageModel.to_message(m) for m in thread.messages]  # type: ignore
     mode = thread.current_mode
     compression = compression_enum(thread.compression)
-    queue = asyncio.Queue()
+    queue = TokenQueue()
 
     # set the defaults, or use what the SessionThread thread asks
     if thread.executor and thread.model:
@@ -522,11 +592,7 @@ async def tools_completions(request: SessionThread):
         task = asyncio.create_task(execute_and_signal())
         task.add_done_callback(handle_exception)
 
-        while True:
-            data = await queue.get()
-
-            if isinstance(data, StopNode):
-                break
+        async for data in queue.drain():
             yield data
 
         try:
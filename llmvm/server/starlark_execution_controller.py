@@ -1,6 +1,6 @@
 import ast
 import asyncio
-import copy
+import hashlib
 import math
 import random
 import re
@@ -13,7 +13,9 @@ from llmvm.common.logging_helpers import (no_indent_debug, response_writer,
 from llmvm.common.objects import (Answer, Assistant, AstNode, Content,
                                   Controller, Executor, FileContent, LLMCall,
                                   Message, PdfContent, Statement, System,
-                                  TokenCompressionMethod, User, awaitable_none)
+                                  TokenCompressionMethod, TokenStopNode, User,
+                                  awaitable_none)
+from llmvm.server.persistent_cache import ResponseCache
 from llmvm.server.starlark_runtime import StarlarkRuntime
 from llmvm.server.tools.pdf import PdfHelpers
 from llmvm.server.vector_search import VectorSearch
@@ -21,6 +23,32 @@ from importlib import resources
 
 logging = setup_logging()
 
+_NUMBER_RE = re.compile(r"[-+]?[0-9]*\.?[0-9]+")
+
+# anthropic often embeds code in ```python blocks, openai in ```starlark, and mistral in bare ``` blocks.
+# checked in order, first marker present wins.
+_CODE_BLOCK_RES = [
+    ('```python', re.compile(r'```python\n(.*?)```', re.DOTALL)),
+    ('```starlark', re.compile(r'```starlark\n(.*?)```', re.DOTALL)),
+    ('```', re.compile(r'```(.*?)```', re.DOTALL)),
+]
+
+
+def find_answers(d: Dict[Any, Any]) -> List[Statement]:
+    current_results = []
+    # a stack of iterators rather than dicts, so nested answers come out in document order
+    stack = [iter(d.values())]
+    while stack:
+        for value in stack[-1]:
+            if isinstance(value, Answer):
+                current_results.append(cast(Answer, value))
+            elif isinstance(value, dict):
+                stack.append(iter(value.values()))
+                break
+        else:
+            stack.pop()
+    return current_results
+
 
 class StarlarkExecutionController(Controller):
     def __init__(
@@ -30,27 +58,69 @@ class StarlarkExecutionController(Controller):
         vector_search: VectorSearch,
         edit_hook: Optional[Callable[[str], str]] = None,
         continuation_passing_style: bool = False,
+        map_reduce_concurrency: int = 4,
+        response_cache: Optional[ResponseCache] = None,
     ):
         super().__init__()
 
         self.executor = executor
         self.agents = agents
+        # agent descriptions are fixed for the lifetime of the controller, so parse the docstrings once
+        self._agent_descriptions = [Helpers.get_function_description_flat_extra(f) for f in self.agents]
         self.vector_search = vector_search
         self.edit_hook = edit_hook
         self.starlark_runtime = StarlarkRuntime(self, agents=self.agents, vector_search=self.vector_search)
         self.continuation_passing_style = continuation_passing_style
+        self.map_reduce_concurrency = max(1, map_reduce_concurrency)
+        self.response_cache = response_cache
+
+    def __token_calculator(self, text: str) -> int:
+        # chunk_and_rank re-counts the same chunks and documents repeatedly; the executor's count
+        # may be a network call (anthropic, gemini), so go through the shared token length cache
+        return Helpers.cached_token_len(
+            text,
+            self.executor.count_tokens,
+            namespace=f'{self.executor.name()}:{self.executor.get_default_model()}',
+        )
+
+    def __response_cache_key(self, llm_call: LLMCall, messages: List[Message]) -> Optional[str]:
+        # only deterministic calls are worth replaying
+        if not self.response_cache or llm_call.temperature != 0.0:
+            return None
+
+        key = repr((
+            llm_call.executor.name(),
+            llm_call.model,
+            llm_call.completion_tokens_len,
+            [Message.to_dict(m) for m in messages],
+        ))
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
 
     async def __llm_call(
         self,
         llm_call: LLMCall,
     ) -> Assistant:
         # execute the call to check to see if the Answer satisfies the original query
-        messages: List[Message] = copy.deepcopy(llm_call.context_messages)
+        # executors only read the messages and serialize them to dicts, so a shallow copy of the list
+        # is enough to keep the user message from leaking into the caller's context
+        messages: List[Message] = list(llm_call.context_messages)
 
         # don't append the user message if it's empty
         if llm_call.user_message.message.get_content().strip() != '':
             messages.append(llm_call.user_message)
 
+        cache_key = self.__response_cache_key(llm_call, messages)
+        cached_response = (
+            await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cache_key and self.response_cache else None
+        )
+        if cached_response is not None:
+            await llm_call.stream_handler(Content(cached_response))
+            await llm_call.stream_handler(TokenStopNode())
+            role_debug(logging, llm_call.prompt_name, 'User', str(llm_call.user_message.message))
+            role_debug(logging, llm_call.prompt_name, 'Assistant', cached_response)
+            return Assistant(message=Content(cached_response), messages_context=messages)
+
         try:
             assistant: Assistant = await llm_call.executor.aexecute(
                 messages,
@@ -65,6 +135,13 @@ class StarlarkExecutionController(Controller):
             role_debug(logging, llm_call.prompt_name, 'User', str(llm_call.user_message.message))
             raise ex
         response_writer(llm_call.prompt_name, assistant)
+
+        if cache_key and self.response_cache and not assistant.error:
+            # the call already succeeded, a failed cache write shouldn't fail it
+            try:
+                await asyncio.to_thread(self.response_cache.set, cache_key, assistant.message.get_content())
+            except Exception as ex:
+                logging.warning(f'__llm_call() failed to write the response cache: {ex}')
         return assistant
 
     async def __llm_call_with_prompt(
@@ -72,12 +149,13 @@ class StarlarkExecutionController(Controller):
         llm_call: LLMCall,
         template: Dict[str, Any],
     ) -> Assistant:
+        executor = self.get_executor()
         prompt = Helpers.load_and_populate_prompt(
             prompt_name=llm_call.prompt_name,
             template=template,
-            user_token=self.get_executor().user_token(),
-            assistant_token=self.get_executor().assistant_token(),
-            append_token=self.get_executor().append_token(),
+            user_token=executor.user_token(),
+            assistant_token=executor.assistant_token(),
+            append_token=executor.append_token(),
         )
         llm_call.user_message = User(Content(prompt['user_message']))
 
@@ -101,10 +179,9 @@ class StarlarkExecutionController(Controller):
                 if result.startswith('Assistant: '):
                     result = result[len('Assistant: '):].strip()
 
-                first = result.split(',')[0].strip()
-                second = result.split(',')[1].strip()
+                first, second = (part.strip() for part in result.split(',', 2)[:2])
 
-                match = re.search(r"[-+]?[0-9]*\.?[0-9]+", second)
+                match = _NUMBER_RE.search(second)
                 if match:
                     second = match.group(0)
 
@@ -120,17 +197,17 @@ class StarlarkExecutionController(Controller):
             return {'tool': 1.0}
 
         # assess the type of task
-        function_list = [Helpers.get_function_description_flat_extra(f) for f in self.agents]
         # todo rip out the probability from here
+        executor = self.get_executor()
         query_understanding = Helpers.load_and_populate_prompt(
             prompt_name='query_understanding.prompt',
             template={
-                'functions': '\n'.join(function_list),
+                'functions': '\n'.join(self._agent_descriptions),
                 'user_input': message.message.get_content(),
             },
-            user_token=self.get_executor().user_token(),
-            assistant_token=self.get_executor().assistant_token(),
-            append_token=self.get_executor().append_token(),
+            user_token=executor.user_token(),
+            assistant_token=executor.assistant_token(),
+            append_token=executor.append_token(),
         )
 
         assistant: Assistant = await self.executor.aexecute(
@@ -142,9 +219,9 @@ class StarlarkExecutionController(Controller):
             stream_handler=stream_handler,
             model=model,
         )
-        if assistant.error or not parse_result(assistant.message.get_content()):
+        if assistant.error:
             return {'tool': 1.0}
-        return parse_result(assistant.message.get_content())
+        return parse_result(assistant.message.get_content()) or {'tool': 1.0}
 
     async def __similarity(
         self,
@@ -164,7 +241,7 @@ class StarlarkExecutionController(Controller):
 
             similarity_chunks = self.vector_search.chunk_and_rank(
                 query=query,
-                token_calculator=self.executor.count_tokens,
+                token_calculator=self.__token_calculator,
                 content=prev_message.message.get_content(),
                 chunk_token_count=256,
                 chunk_overlap=0,
@@ -210,7 +287,6 @@ class StarlarkExecutionController(Controller):
 
         # collapse the context messages into single message
         context_message = User(Content('\n\n'.join([m.message.get_content() for m in llm_call.context_messages])))
-        chunk_results = []
 
         # iterate over the data.
         map_reduce_prompt_tokens = self.executor.count_tokens(
@@ -225,26 +301,34 @@ class StarlarkExecutionController(Controller):
             overlap=0
         )
 
-        for chunk in chunks:
-            chunk_assistant = await self.__llm_call_with_prompt(
-                llm_call=LLMCall(
-                    user_message=User(Content()),
-                    context_messages=[],
-                    executor=llm_call.executor,
-                    model=llm_call.model,
-                    temperature=llm_call.temperature,
-                    max_prompt_len=llm_call.max_prompt_len,
-                    completion_tokens_len=llm_call.completion_tokens_len,
-                    prompt_name='map_reduce_map.prompt',
-                    stream_handler=llm_call.stream_handler,
-                ),
-                template={
-                    'original_query': original_query,
-                    'query': query,
-                    'data': chunk,
-                },
-            )
-            chunk_results.append(chunk_assistant.message.get_content())
+        # the map calls are independent, so run them concurrently (bounded, to stay under provider rate limits).
+        # tokens from concurrent calls would interleave on the client, so only stream the map phase when it's serial.
+        semaphore = asyncio.Semaphore(self.map_reduce_concurrency)
+        map_stream_handler = llm_call.stream_handler if self.map_reduce_concurrency == 1 else awaitable_none
+
+        async def map_chunk(chunk: str) -> str:
+            async with semaphore:
+                chunk_assistant = await self.__llm_call_with_prompt(
+                    llm_call=LLMCall(
+                        user_message=User(Content()),
+                        context_messages=[],
+                        executor=llm_call.executor,
+                        model=llm_call.model,
+                        temperature=llm_call.temperature,
+                        max_prompt_len=llm_call.max_prompt_len,
+                        completion_tokens_len=llm_call.completion_tokens_len,
+                        prompt_name='map_reduce_map.prompt',
+                        stream_handler=map_stream_handler,
+                    ),
+                    template={
+                        'original_query': original_query,
+                        'query': query,
+                        'data': chunk,
+                    },
+                )
+                return chunk_assistant.message.get_content()
+
+        chunk_results: List[str] = await asyncio.gather(*[map_chunk(chunk) for chunk in chunks])
 
         # perform the reduce
         map_results = '\n\n====\n\n' + '\n\n====\n\n'.join(chunk_results)
@@ -320,7 +404,7 @@ class StarlarkExecutionController(Controller):
         llm_call: LLMCall
     ) -> Assistant:
         write_client_stream('Performing context window compression type: last-in-first-out.\n')
-        lifo_messages = copy.deepcopy(llm_call.context_messages)
+        lifo_messages = llm_call.context_messages
 
         prompt_context_messages = [llm_call.user_message]
         current_tokens = self.executor.count_tokens(
@@ -330,12 +414,10 @@ class StarlarkExecutionController(Controller):
 
         # reverse over the messages, last to first
         for i in range(len(lifo_messages) - 1, -1, -1):
-            if (
-                current_tokens + self.executor.count_tokens(lifo_messages[i].message.get_content(), model=llm_call.model)
-                < llm_call.max_prompt_len
-            ):
+            message_tokens = self.executor.count_tokens(lifo_messages[i].message.get_content(), model=llm_call.model)
+            if current_tokens + message_tokens < llm_call.max_prompt_len:
                 prompt_context_messages.append(lifo_messages[i])
-                current_tokens += self.executor.count_tokens(lifo_messages[i].message.get_content(), model=llm_call.model)
+                current_tokens += message_tokens
             else:
                 break
 
@@ -347,6 +429,19 @@ class StarlarkExecutionController(Controller):
         )
         return assistant_result
 
+    def __fits_by_byte_len(self, messages: List[Message], max_prompt_len: int) -> bool:
+        # every token covers at least one utf-8 byte, so if the raw text (plus a generous
+        # per-message allowance for role/framing tokens) is under the limit, the tokens are too.
+        # images, pdfs and files are counted differently, so they always go through count_tokens.
+        total = 3
+        for message in messages:
+            if type(message.message) is not Content:
+                return False
+            total += 8 + len(message.message.get_content().encode('utf-8'))
+            if total > max_prompt_len:
+                return False
+        return True
+
     async def aexecute_llm_call(
         self,
         llm_call: LLMCall,
@@ -377,9 +472,14 @@ class StarlarkExecutionController(Controller):
                 text_result = PdfHelpers.parse_pdf(c_message.message.url)
                 c_message.message.sequence = text_result
 
-        prompt_len = self.executor.count_tokens(llm_call.context_messages + [llm_call.user_message], model=llm_call.model)
         max_prompt_len = self.executor.max_prompt_tokens(completion_token_len=llm_call.completion_tokens_len, model=model)
 
+        # most calls are nowhere near the context window, so skip the tokenizer when we can
+        if self.__fits_by_byte_len(llm_call.context_messages + [llm_call.user_message], max_prompt_len):
+            return await self.__llm_call(llm_call=llm_call)
+
+        prompt_len = self.executor.count_tokens(llm_call.context_messages + [llm_call.user_message], model=llm_call.model)
+
         # I have either a message, or a list of messages. They might need to be map/reduced.
         # todo: we usually have a prepended message of context to help the LLM figure out
         # what to do with the message at a later stage. This is getting removed right now.
@@ -405,7 +505,7 @@ class StarlarkExecutionController(Controller):
             write_client_stream('Determining context window compression approach of either similarity vector search, or full map/reduce.\n')
             similarity_chunks = self.vector_search.chunk_and_rank(
                 query=query,
-                token_calculator=self.executor.count_tokens,
+                token_calculator=self.__token_calculator,
                 content=context_message.message.get_content(),
                 chunk_token_count=256,
                 chunk_overlap=0,
@@ -513,7 +613,10 @@ class StarlarkExecutionController(Controller):
         logging.debug(f'abuild_runnable_tools_ast() user_message = {llm_call.user_message.message.get_content()[0:25]}')
         logging.debug(f'abuild_runnable_tools_ast() model = {llm_call.model}, executor = {llm_call.executor.name()}')
 
-        functions = [Helpers.get_function_description_flat_extra(f) for f in agents]
+        if agents is self.agents:
+            functions = self._agent_descriptions
+        else:
+            functions = [Helpers.get_function_description_flat_extra(f) for f in agents]
 
         tools_message = Helpers.prompt_message(
             prompt_name='starlark_tool_execution.prompt',
@@ -556,15 +659,6 @@ class StarlarkExecutionController(Controller):
     ) -> List[Statement]:
         model = model if model else self.executor.get_default_model()
 
-        def find_answers(d: Dict[Any, Any]) -> List[Statement]:
-            current_results = []
-            for _, value in d.items():
-                if isinstance(value, Answer):
-                    current_results.append(cast(Answer, value))
-                if isinstance(value, dict):
-                    current_results.extend(find_answers(value))
-            return current_results
-
         results: List[Statement] = []
 
         # assess the type of task
@@ -624,21 +718,12 @@ class StarlarkExecutionController(Controller):
                 )
             assistant_response_str = response.message.get_content().replace('Assistant:', '').strip()
 
-            # anthropic can often embed the code in ```python blocks
-            if '```python' in assistant_response_str:
-                match = re.search(r'```python\n(.*?)```', assistant_response_str, re.DOTALL)
-                if match:
-                    assistant_response_str = match.group(1)
-            # openai can often embed the code in ```starlark blocks
-            elif '```starlark' in assistant_response_str:
-                match = re.search(r'```starlark\n(.*?)```', assistant_response_str, re.DOTALL)
-                if match:
-                    assistant_response_str = match.group(1)
-            # mistral likes to embed the code in ``` blocks
-            elif '```' in assistant_response_str:
-                match = re.search(r'```(.*?)```', assistant_response_str, re.DOTALL)
-                if match:
-                    assistant_response_str = match.group(1)
+            for marker, code_block_re in _CODE_BLOCK_RES:
+                if marker in assistant_response_str:
+                    match = code_block_re.search(assistant_response_str)
+                    if match:
+                        assistant_response_str = match.group(1)
+                    break
 
             no_indent_debug(logging, '')
             no_indent_debug(logging, '** [bold yellow]Starlark Abstract Syntax Tree:[/bold yellow] **')
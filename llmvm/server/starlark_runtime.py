@@ -1,9 +1,11 @@
 import ast
+import copy
 import datetime as dt
 import inspect
 import os
 import re
 import sys
+from logging import DEBUG
 from typing import Any, Callable, Dict, List, Optional, Tuple, cast
 from urllib.parse import urlparse
 
@@ -23,24 +25,46 @@ from llmvm.server.vector_search import VectorSearch
 
 logging = setup_logging()
 
+_LIST_RE = re.compile(r'\[\s*(?:(\d+|"[^"]*"|\'[^\']*\')\s*,\s*)*(\d+|"[^"]*"|\'[^\']*\')\s*\]')
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def _detach(value: Any) -> Any:
+    # cached results are handed out more than once, so never share a mutable object between callers
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return value
+    return copy.deepcopy(value)
+
 
 class StarlarkRuntime:
     def __init__(
         self,
         controller: Controller,
         vector_search: VectorSearch,
-        agents: List[Callable] = [],
+        agents: Optional[List[Callable]] = None,
     ):
         self.original_query = ''
         self.original_code = ''
         self.controller: Controller = controller
         self.vector_search = vector_search
-        self.agents = agents
+        self.agents = agents if agents is not None else []
         self.locals_dict = {}
         self.globals_dict = {}
         self.answers: List[Answer] = []
         self.messages_list: List[Message] = []
         self.answer_error_correcting = False
+        # memoized results of @pure tool calls, keyed on (name, frozen args)
+        # survives setup() so re-runs of corrected code can reuse it
+        self.call_cache: Dict[Tuple, Any] = {}
         self.setup()
 
     def setup(self):
@@ -68,7 +92,10 @@ class StarlarkRuntime:
                             code_line = self.outer_self.original_code.split('\n')[caller_frame_lineno - 1]
 
                             # todo: we should probably do the marshaling here too
-                            result = attr(*args, **kwargs)
+                            if getattr(attr, '_pure', False):
+                                result = self.call_pure(attr, args, kwargs)
+                            else:
+                                result = attr(*args, **kwargs)
 
                             meta = FunctionCallMeta(
                                 callsite=code_line,
@@ -80,6 +107,21 @@ class StarlarkRuntime:
                         return wrapper
                 raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
 
+            def call_pure(self, attr, args, kwargs):
+                call_cache = self.outer_self.call_cache
+                try:
+                    key = (attr.__qualname__, _freeze(args), _freeze(kwargs))
+                    if key in call_cache:
+                        logging.debug(f'CallWrapper.call_pure() cache hit for {attr.__qualname__}')
+                        return _detach(call_cache[key])
+                except TypeError:
+                    # unhashable arguments, just make the call
+                    return attr(*args, **kwargs)
+
+                result = attr(*args, **kwargs)
+                call_cache[key] = _detach(result)
+                return result
+
         from llmvm.server.bcl import BCL, SourceProject
 
         self.answers = []
@@ -584,8 +626,7 @@ class StarlarkRuntime:
 
         # for anthropic
         if not list_result.startswith('['):
-            pattern = r'\[\s*(?:(\d+|"[^"]*"|\'[^\']*\')\s*,\s*)*(\d+|"[^"]*"|\'[^\']*\')\s*\]'
-            match = re.search(pattern, list_result)
+            match = _LIST_RE.search(list_result)
             if match:
                 list_result = match.group(0)
 
@@ -815,10 +856,10 @@ class StarlarkRuntime:
             original_query=self.original_query,
         )
 
-        lines = str(assistant.message).split('\n')
-        logging.debug('compile_error() Re-written Starlark code:')
-        for line in lines:
-            logging.debug(f'  {str(line)}')
+        if logging.isEnabledFor(DEBUG):
+            logging.debug('compile_error() Re-written Starlark code:')
+            for line in str(assistant.message).split('\n'):
+                logging.debug(f'  {str(line)}')
         return str(assistant.message)
 
     def rewrite(
@@ -868,10 +909,10 @@ class StarlarkRuntime:
             query=self.original_query,
             original_query=self.original_query,
         )
-        lines = str(assistant.message).split('\n')
-        logging.debug('rewrite() Re-written Starlark code:')
-        for line in lines:
-            logging.debug(f'  {str(line)}')
+        if logging.isEnabledFor(DEBUG):
+            logging.debug('rewrite() Re-written Starlark code:')
+            for line in str(assistant.message).split('\n'):
+                logging.debug(f'  {str(line)}')
         return str(assistant.message)
 
     def __eval_with_error_wrapper(
@@ -901,11 +942,11 @@ class StarlarkRuntime:
         self,
         starlark_code: str,
         original_query: str,
-        messages: List[Message] = [],
+        messages: Optional[List[Message]] = None,
     ) -> Dict[Any, Any]:
         self.original_code = starlark_code
         self.original_query = original_query
-        self.messages_list = messages
+        self.messages_list = messages if messages is not None else []
         # todo: why are we running setup again here?
         # self.setup()
         self.locals_dict = {}
@@ -917,17 +958,22 @@ class StarlarkRuntime:
         starlark_code: str,
     ) -> Dict[Any, Any]:
         parsed_ast = ast.parse(starlark_code)
+        # unparsing every node (and stringifying every result) is only worth it if someone will read it
+        debug = logging.isEnabledFor(DEBUG)
 
         for node in parsed_ast.body:
             if isinstance(node, ast.Expr):
-                logging.debug(f'[eval] {astunparse.unparse(node)}')
+                if debug:
+                    logging.debug(f'[eval] {astunparse.unparse(node)}')
                 result = eval(
                     compile(ast.Expression(node.value), '<string>', 'eval'),
                     {**self.globals_dict, **self.locals_dict}
                 )
-                logging.debug(f'[=>] {result}')
+                if debug:
+                    logging.debug(f'[=>] {result}')
             else:
-                logging.debug(f'[exec] {astunparse.unparse(node)}')
+                if debug:
+                    logging.debug(f'[exec] {astunparse.unparse(node)}')
                 exec(
                     compile(ast.Module(body=[node], type_ignores=[]), '<string>', 'exec'),
                     self.globals_dict,
@@ -939,10 +985,10 @@ class StarlarkRuntime:
         self,
         starlark_code: str,
         original_query: str,
-        messages: List[Message] = [],
+        messages: Optional[List[Message]] = None,
     ) -> Dict[Any, Any]:
         self.original_code = starlark_code
         self.original_query = original_query
-        self.messages_list = messages
+        self.messages_list = messages if messages is not None else []
         self.setup()
         return self.__interpret(starlark_code)
@@ -1,5 +1,8 @@
+import os
+import shutil
 import tempfile
 from cgitb import text
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import List, Optional
 from urllib.parse import urlparse
@@ -7,6 +10,7 @@ from urllib.parse import urlparse
 import pdf2image
 import pytesseract
 import requests
+from requests.adapters import HTTPAdapter
 from pdfminer.high_level import extract_text_to_fp
 from pypdf import PdfReader
 from pytesseract import Output
@@ -17,6 +21,11 @@ from llmvm.common.objects import StreamNode
 
 logging = setup_logging()
 
+# pooled keep-alive session, so repeated pdf downloads from the same host skip the TCP/TLS handshake
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+_session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
 
 class PdfHelpers():
     @staticmethod
@@ -28,6 +37,20 @@ class PdfHelpers():
             images[0].save(byte_stream, format='PNG')
             return Helpers.resize_image(byte_stream.getvalue())
 
+    @staticmethod
+    def __ocr_pages(images) -> List[str]:
+        def ocr(pil_im) -> str:
+            ocr_dict = pytesseract.image_to_data(pil_im, output_type=Output.DICT)
+            return ' '.join(ocr_dict['text'])
+
+        if len(images) <= 1:
+            return [ocr(pil_im) for pil_im in images]
+
+        # pytesseract shells out to the tesseract binary per page, so threads are enough
+        # to run pages in parallel without pickling images across a process pool
+        with ThreadPoolExecutor(max_workers=min(len(images), os.cpu_count() or 1)) as pool:
+            return list(pool.map(ocr, images))
+
     @staticmethod
     def __get_pdf(url_or_file: str) -> Optional[BytesIO]:
         url_result = urlparse(url_or_file)
@@ -37,12 +60,18 @@ class PdfHelpers():
         stream = None
 
         if url_result.scheme == 'http' or url_result.scheme == 'https':
-            content = requests.get(url_or_file, headers=headers, allow_redirects=True, timeout=10).content
-            stream = BytesIO(content)
+            # stream the body straight into the buffer rather than holding .content and a copy of it
+            stream = BytesIO()
+            with _session.get(url_or_file, headers=headers, allow_redirects=True, timeout=10, stream=True) as response:
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, stream, 1 << 16)
+            stream.seek(0)
         else:
             try:
                 with open(url_or_file, 'rb') as file:
-                    stream = BytesIO(file.read())
+                    stream = BytesIO()
+                    shutil.copyfileobj(file, stream, 1 << 16)
+                    stream.seek(0)
             except FileNotFoundError:
                 raise ValueError('The supplied argument url_or_file: {} is not a correct filename or url.'.format(url_or_file))
         return stream
@@ -58,13 +87,8 @@ class PdfHelpers():
     def parse_pdf_image(url_or_file: str) -> str:
         result = urlparse(url_or_file)
 
-        text_chunks: List[str] = []
         images = pdf2image.convert_from_path(result.path)  # type: ignore
-        for pil_im in images:
-            ocr_dict = pytesseract.image_to_data(pil_im, output_type=Output.DICT)
-            text_chunks.append(' '.join(ocr_dict['text']))
-
-        return '\n'.join(text_chunks)
+        return '\n'.join(PdfHelpers.__ocr_pages(images))
 
     @staticmethod
     def parse_pdf(url_or_file: str) -> str:
@@ -120,22 +144,10 @@ class PdfHelpers():
         Returns:
             str: text from pdf
         """
-        url_result = urlparse(url_or_file)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'  # type: ignore
-        }
-        stream = None
         text_result = ''
-
-        if url_result.scheme == 'http' or url_result.scheme == 'https':
-            content = requests.get(url_or_file, headers=headers, allow_redirects=True, timeout=10).content
-            stream = BytesIO(content)
-        else:
-            try:
-                with open(url_or_file, 'rb') as file:
-                    stream = BytesIO(file.read())
-            except FileNotFoundError:
-                raise ValueError('The supplied argument url_or_file: {} is not a correct filename or url.'.format(url_or_file))
+        stream = PdfHelpers.__get_pdf(url_or_file)
+        if not stream:
+            return ''
 
         reader = PdfReader(stream)
 
@@ -149,14 +161,8 @@ class PdfHelpers():
 
         if len(text_result) == 0:
             stream.seek(0)
-            texts = []
             # try tesselation of pdf
             images = pdf2image.convert_from_bytes(stream.read())  # type: ignore
-            # images = pdf2image.convert(url_result.path)  # type: ignore
-            for pil_im in images:
-                ocr_dict = pytesseract.image_to_data(pil_im, output_type=Output.DICT)
-                texts.append(' '.join(ocr_dict['text']))
-
-            text_result = ' '.join(texts)
+            text_result = ' '.join(PdfHelpers.__ocr_pages(images))
 
         return text_result
@@ -8,7 +8,7 @@ from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 from markdownify import MarkdownConverter
 
-from llmvm.common.helpers import write_client_stream
+from llmvm.common.helpers import pure, write_client_stream
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.server.tools.firefox import FirefoxHelpers
 from llmvm.server.tools.pdf import PdfHelpers
@@ -24,6 +24,7 @@ firefox_helpers = FirefoxHelpers()
 
 class WebHelpers():
     @staticmethod
+    @pure
     def convert_html_to_markdown(html: str) -> str:
         def clean_markdown(markdown_text: str) -> str:
             lines = []
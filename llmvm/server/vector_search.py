@@ -61,26 +61,25 @@ class VectorSearch():
         min_score: float = 0.0,
     ) -> List[Dict[str, Any]]:
         documents = self.vector_store.search_document(query, max_results)
-        search_results = [
-            {
-                'title': document.metadata['title'],
-                'link': document.metadata['url'],
-                'snippet': document.page_content,
-                'score': document.metadata['score'],
-                'metadata': document.metadata,
-            }
-            for document in documents
-            if 'score' in document.metadata
-            and document.metadata['score'] >= min_score
-            and 'url' in document.metadata
-            and 'title' in document.metadata
-        ]
 
-        # now we need to merge the results by link
-        merged_results = {}
-        for result in search_results:
-            if result['link'] not in merged_results:
-                merged_results[result['link']] = result
+        # filter and merge the results by link in a single pass, first (highest ranked) result wins
+        merged_results: Dict[str, Dict[str, Any]] = {}
+        for document in documents:
+            metadata = document.metadata
+            if (
+                'score' in metadata
+                and metadata['score'] >= min_score
+                and 'url' in metadata
+                and 'title' in metadata
+                and metadata['url'] not in merged_results
+            ):
+                merged_results[metadata['url']] = {
+                    'title': metadata['title'],
+                    'link': metadata['url'],
+                    'snippet': document.page_content,
+                    'score': metadata['score'],
+                    'metadata': metadata,
+                }
 
         return list(merged_results.values())
 
@@ -145,18 +144,8 @@ class VectorSearch():
         url: str,
         metadata: dict
     ) -> None:
-        for m in messages:
-            logging.debug('ingesting message: {}'.format(str(m.message)[0:25]))
-            entity = self.parse_metadata(
-                content=str(m.message),
-                title=title,
-                url=url,
-                type='message',
-                ingest_datetime=dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                parent='',
-                extra_metdata=metadata
-            )
-            self.vector_store.ingest_text(str(m.message), metadata)
+        logging.debug('ingesting {} messages'.format(len(messages)))
+        self.vector_store.ingest_texts([str(m.message) for m in messages], metadata)
 
     def ingest_text(
         self,
@@ -1,15 +1,17 @@
+import hashlib
+import io
 import math
 import os
-import tempfile
 from typing import Callable, List, Optional, Tuple
 
 import numpy as np
 from langchain.docstore.document import Document
 from langchain.embeddings.huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import TextSplitter, TokenTextSplitter
-from langchain_community.document_loaders import TextLoader
+from langchain.text_splitter import (RecursiveCharacterTextSplitter,
+                                     TextSplitter, TokenTextSplitter)
 
 from llmvm.common.logging_helpers import setup_logging
+from llmvm.server.persistent_cache import DirectoryCache
 
 logging = setup_logging()
 
@@ -21,8 +23,14 @@ class VectorStore():
         embedding_model: str,
         chunk_size: int = 500,
         chunk_overlap: int = 50,
+        index_type: str = 'flat',
+        chunk_cache_max_entries: int = 1000,
     ):
+        if index_type not in ('flat', 'hnsw'):
+            raise ValueError(f'unknown index_type {index_type}, expected flat or hnsw')
+
         self._embeddings = None
+        self.index_type = index_type
         self.embedding_model = embedding_model
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
@@ -32,9 +40,17 @@ class VectorStore():
         if not os.path.exists(self.store_directory):
             os.makedirs(self.store_directory)
 
+        # embeddings of ranked documents, keyed by content hash. 0 turns the cache off.
+        self._chunk_cache: Optional[DirectoryCache] = None
+        if chunk_cache_max_entries > 0:
+            self._chunk_cache = DirectoryCache(
+                os.path.join(self.store_directory, 'chunk_cache'),
+                max_entries=chunk_cache_max_entries,
+            )
+
         if not os.path.exists(os.path.join(self.store_directory, self.index_name + '.faiss')):
             from langchain_community.vectorstores.faiss import FAISS
-            self.store: FAISS = FAISS.from_texts([''], self.embeddings())
+            self.store: FAISS = self.__new_store([''])
             self.store.override_relevance_score_fn = self.__score_normalizer
             self.store.save_local(folder_path=self.store_directory, index_name=self.index_name)
 
@@ -47,6 +63,29 @@ class VectorStore():
             )
         return self._embeddings
 
+    def __new_store(self, texts: List[str]):
+        from langchain_community.vectorstores.faiss import FAISS
+        if self.index_type == 'flat':
+            return FAISS.from_texts(texts, self.embeddings())
+
+        # hnsw trades build time for sub-linear search on large stores. the embeddings are
+        # normalized, so L2 ordering matches cosine ordering and the score normalizer still applies
+        import faiss
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        dimensions = len(self.embeddings().embed_query(''))
+        index = faiss.IndexHNSWFlat(dimensions, 32)
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 64
+        store = FAISS(
+            embedding_function=self.embeddings(),
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+        store.add_texts(texts)
+        return store
+
     def __metadata_str(self, document: Document):
         if document.metadata:
             return ', '.join([f'{str(k)}: {str(v)}' for k, v in document.metadata.items()])
@@ -78,29 +117,30 @@ class VectorStore():
         self.__load_store().save_local(folder_path=self.store_directory, index_name=self.index_name)
 
     def ingest_text(self, text: str, metadata: Optional[dict] = None):
-        documents = []
-
-        with tempfile.NamedTemporaryFile(suffix='.txt', mode='w', delete=True) as t:
-            t.write(text)
-            t.seek(0)
-            text_loader = TextLoader(t.name)
-            data = text_loader.load()
-            documents = text_loader.load_and_split()
+        self.ingest_texts([text], metadata)
 
-        if metadata:
-            for d in documents:
-                d.metadata = metadata
+    def ingest_texts(self, texts: List[str], metadata: Optional[dict] = None):
+        # split everything up front so the embedding model sees one batch and the index is saved once
+        documents = RecursiveCharacterTextSplitter().split_documents(
+            [Document(page_content=text, metadata=dict(metadata) if metadata else {}) for text in texts]
+        )
 
         text_splitter = TokenTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
         split_texts = text_splitter.split_documents(documents)
+        if not split_texts:
+            return
+
         self.__load_store().add_documents(split_texts)
         self.__load_store().save_local(folder_path=self.store_directory, index_name=self.index_name)
 
     def search_document(self, query: str, max_results: int = 4) -> List[Document]:
         documents = self.__load_store().similarity_search_with_relevance_scores(query, k=max_results)
+        results = []
         for doc, score in documents:
             doc.metadata['score'] = score
-        return [doc for doc, _ in documents if doc.page_content]
+            if doc.page_content:
+                results.append(doc)
+        return results
 
     def search(self, query: str, max_results: int = 4) -> List[str]:
         result = self.__load_store().similarity_search(query, k=max_results)
@@ -117,6 +157,28 @@ class VectorStore():
         text_splitter = TokenTextSplitter(chunk_size=_chunk_size, chunk_overlap=_overlap)
         return text_splitter.split_text(content)
 
+    def __load_chunk_embeddings(self, cache_key: str, chunk_count: int) -> Optional[np.ndarray]:
+        data = self._chunk_cache.get_bytes(cache_key)  # type: ignore
+        if data is None:
+            return None
+        try:
+            chunk_embeddings = np.load(io.BytesIO(data))
+        except Exception as ex:
+            logging.debug(f'VectorStore.chunk_and_rank() ignoring unreadable chunk cache entry {cache_key}: {ex}')
+            return None
+        # a truncated or stale entry is just a miss
+        if chunk_embeddings.ndim != 2 or chunk_embeddings.shape[0] != chunk_count:
+            return None
+        return chunk_embeddings
+
+    def __save_chunk_embeddings(self, cache_key: str, chunk_embeddings: np.ndarray) -> None:
+        buffer = io.BytesIO()
+        np.save(buffer, chunk_embeddings)
+        try:
+            self._chunk_cache.set_bytes(cache_key, buffer.getvalue())  # type: ignore
+        except Exception as ex:
+            logging.warning(f'VectorStore.chunk_and_rank() failed to write the chunk cache: {ex}')
+
     def chunk_and_rank(
         self,
         query: str,
@@ -127,17 +189,12 @@ class VectorStore():
         max_tokens: int = 0,
         splitter: Optional[TextSplitter] = None,
     ) -> List[Tuple[str, float]]:
-        from langchain_community.vectorstores.faiss import FAISS
-
         if max_tokens == 0:
             raise ValueError('max_tokens must be greater than 0')
 
         if not content:
             return []
 
-        def contains_token(s, tokens):
-            return any(token in s for token in tokens)
-
         if splitter:
             text_splitter = splitter
         else:
@@ -148,11 +205,32 @@ class VectorStore():
         token_chunk_cost = token_calculator(split_texts[0])
 
         logging.debug(f'VectorStore.chunk_and_rank document length: {len(content)} split_texts: {len(split_texts)}, token_chunk_cost: {token_chunk_cost}, max_tokens: {max_tokens}')  # noqa
-        chunk_faiss = FAISS.from_texts(split_texts, self.embeddings())
-        chunk_faiss.override_relevance_score_fn = self.__score_normalizer
-
-        chunk_k = math.floor(max_tokens / token_chunk_cost)
-        result = chunk_faiss.similarity_search_with_relevance_scores(query, k=chunk_k * 5)
+        # the chunk embeddings are a pure function of the content and the chunking parameters, so persist them
+        # and skip re-embedding when the same document is ranked again. custom splitters aren't keyed.
+        cache_key = None
+        if self._chunk_cache and not splitter:
+            cache_key = hashlib.sha256(
+                f'{self.embedding_model}:{chunk_token_count}:{chunk_overlap}:{content}'.encode('utf-8')
+            ).hexdigest() + '.npy'
+
+        chunk_embeddings = self.__load_chunk_embeddings(cache_key, len(split_texts)) if cache_key else None
+        if chunk_embeddings is None:
+            # one batched embedding call for every chunk, rather than building a throwaway faiss index
+            chunk_embeddings = np.asarray(self.embeddings().embed_documents(split_texts), dtype=np.float32)
+            chunk_embeddings /= np.linalg.norm(chunk_embeddings, axis=1, keepdims=True)
+            if cache_key:
+                self.__save_chunk_embeddings(cache_key, chunk_embeddings)
+
+        query_embedding = np.asarray(self.embeddings().embed_query(query), dtype=np.float32)
+        query_embedding /= np.linalg.norm(query_embedding)
+        similarities = chunk_embeddings @ query_embedding
+
+        # top-k without a full sort, then order just the top-k by similarity
+        chunk_k = min(math.floor(max_tokens / token_chunk_cost) * 5, len(split_texts))
+        if chunk_k <= 0:
+            return []
+        top_k = np.argpartition(-similarities, chunk_k - 1)[:chunk_k]
+        top_k = top_k[np.argsort(-similarities[top_k])]
 
         total_tokens = token_calculator(query)
         return_results = []
@@ -161,7 +239,10 @@ class VectorStore():
             mid = len(s) // 2
             return s[:mid]
 
-        for doc, rank in result:
+        for i in top_k:
+            doc = Document(page_content=split_texts[i])
+            # keep the scores the faiss path produced: squared L2 between unit vectors is 2 - 2cos
+            rank = float(self.__score_normalizer(2.0 - 2.0 * float(similarities[i])))
             if total_tokens + token_calculator(doc.page_content) < max_tokens:
                 return_results.append((self.__document_str(doc), rank))
                 total_tokens += token_calculator(self.__document_str(doc))
@@ -169,7 +250,7 @@ class VectorStore():
                 half_str(doc.page_content)
                 and total_tokens + token_calculator(half_str(doc.page_content)) < max_tokens
             ):
-                return_results.append((half_str(self.__document_str(doc))[0], rank))
+                return_results.append((half_str(self.__document_str(doc)), rank))
                 total_tokens += token_calculator(half_str(self.__document_str(doc)))
             else:
                 break
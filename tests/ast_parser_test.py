@@ -0,0 +1,44 @@
+from llmvm.server.ast_parser import Parser
+
+
+def get(url: str) -> str:
+    """
+    Gets something.
+    """
+    return url
+
+
+def get_url(url: str) -> str:
+    """
+    Gets a url.
+    """
+    return url
+
+
+def search(query: str) -> str:
+    """
+    Searches for something.
+    """
+    return query
+
+
+def parser() -> Parser:
+    parser = Parser()
+    parser.agents = [get, get_url, search]
+    return parser
+
+
+def test_get_callsite_prefers_exact_name():
+    # 'get' is a substring of 'get_url', but the exact name wins
+    assert parser().get_callsite('get_url("https://x.com")').func is get_url
+    assert parser().get_callsite('get("https://x.com")').func is get
+
+
+def test_get_callsite_qualified_name():
+    assert parser().get_callsite('WebHelpers.get_url("https://x.com")').func is get_url
+    assert parser().get_callsite('Search.SEARCH("llmvm")').func is search
+
+
+def test_get_callsite_falls_back_to_substring():
+    assert parser().get_callsite('do_search("llmvm")').func is search
+    assert parser().get_callsite('unknown("llmvm")') is None
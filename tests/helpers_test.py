@@ -0,0 +1,21 @@
+from llmvm.common.helpers import Helpers
+
+
+def test_in_between():
+    assert Helpers.in_between('say "hello" there', '"', '"') == 'hello'
+    assert Helpers.in_between('func(a, b)', '(', ')') == 'a, b'
+    assert Helpers.in_between('func(a, b)', '', '(') == 'func'
+    assert Helpers.in_between('key: value', 'key: ', '\n') == 'value'
+    assert Helpers.in_between('[a]\nb', '[a]', '\n') == ''
+
+
+def test_split_between():
+    assert Helpers.split_between('abc<x>def</x>ghi', '<x>', '</x>') == ('abc', 'ghi')
+    assert Helpers.split_between('<x></x>', '<x>', '</x>') == ('', '')
+
+
+def test_flatten():
+    assert Helpers.flatten([]) == []
+    assert Helpers.flatten([1, 2, 3]) == [1, 2, 3]
+    assert Helpers.flatten([1, [2, [3, [4]], 5], [], [[6]]]) == [1, 2, 3, 4, 5, 6]
+    assert Helpers.flatten([(1, 2), 'ab', [None]]) == [(1, 2), 'ab', None]
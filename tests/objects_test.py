@@ -0,0 +1,23 @@
+from llmvm.common.objects import _is_numeric_str, coerce_types
+
+
+def test_is_numeric_str():
+    for s in ['0', '42', '-7', '+3', '3.14', '.5', '5.', ' 12 ', '١٢']:
+        assert _is_numeric_str(s), s
+
+    for s in ['', 'abc', '1.2.3', '1e5', '--1', '12a', 'nan']:
+        assert not _is_numeric_str(s), s
+
+
+def test_coerce_types_numeric_strings():
+    assert coerce_types('1', 2) == (1, 2)
+    assert coerce_types(2, '1.5') == (2.0, 1.5)
+    assert coerce_types('3', '4') == (3, 4)
+    assert coerce_types('١٢', 1) == (12, 1)
+
+
+def test_coerce_types_mixed():
+    assert coerce_types(1, 2) == (1, 2)
+    assert coerce_types(1, 2.5) == (1.0, 2.5)
+    assert coerce_types('abc', 1) == ('abc', '1')
+    assert coerce_types('a', 'b') == ('a', 'b')
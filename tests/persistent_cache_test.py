@@ -0,0 +1,45 @@
+import os
+
+from llmvm.server.persistent_cache import ResponseCache
+
+
+def test_response_cache_reads_back_stored_entry(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=10)
+    cache.set('abc', 'a response ✓')
+
+    assert cache.get('abc') == 'a response ✓'
+    assert cache.get('missing') is None
+    assert cache.get('missing', 'default') == 'default'
+
+    # a new instance over the same directory sees the entry
+    assert ResponseCache(str(tmp_path), max_entries=10).get('abc') == 'a response ✓'
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=10)
+    for i in range(10):
+        cache.set(f'key{i}', str(i))
+        os.utime(tmp_path / f'key{i}', (i, i))
+
+    # reading an entry makes it the most recently used
+    assert cache.get('key0') == '0'
+    cache.set('key10', '10')
+
+    # trimmed to 90% of max_entries, oldest first
+    assert sorted(os.listdir(tmp_path)) == sorted(['key0', 'key10'] + [f'key{i}' for i in range(3, 10)])
+    assert cache.get('key1') is None
+    assert cache.get('key0') == '0'
+
+
+def test_response_cache_ignores_temp_files(tmp_path):
+    # an in-flight write, older than any entry
+    (tmp_path / 'inflight.tmp').write_text('partial')
+    os.utime(tmp_path / 'inflight.tmp', (0, 0))
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    os.utime(tmp_path / 'a', (1, 1))
+    os.utime(tmp_path / 'b', (2, 2))
+    cache.set('c', '3')
+
+    assert sorted(os.listdir(tmp_path)) == ['c', 'inflight.tmp']
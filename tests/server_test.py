@@ -0,0 +1,32 @@
+import jsonpickle
+
+from llmvm.common.objects import Assistant, Content, TokenStopNode
+from llmvm.server.server import encode_stream_chunk
+
+
+def decode(chunk) -> object:
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode('utf-8')
+    assert chunk.startswith('data: ') and chunk.endswith('\n\n')
+    return jsonpickle.decode(chunk[len('data: '):])
+
+
+def test_encode_stream_chunk_token():
+    content = decode(encode_stream_chunk(Content('he said "hi"\n')))
+
+    assert type(content) is Content
+    assert content.sequence == ['he said "hi"\n']
+    assert content.content_type == 'text'
+
+
+def test_encode_stream_chunk_token_stop():
+    assert type(decode(encode_stream_chunk(TokenStopNode()))) is TokenStopNode
+
+
+def test_encode_stream_chunk_falls_back_to_jsonpickle():
+    chunk = encode_stream_chunk(Content(b'bytes', content_type='pdf'))
+    assert chunk == f'data: {jsonpickle.encode(Content(b"bytes", content_type="pdf"))}\n\n'
+
+    assistant = decode(encode_stream_chunk(Assistant(Content('x'))))
+    assert type(assistant) is Assistant
+    assert assistant.message.sequence == ['x']
@@ -0,0 +1,19 @@
+from llmvm.common.objects import Answer
+from llmvm.server.starlark_execution_controller import find_answers
+
+
+def test_find_answers_keeps_document_order():
+    first, second, third, fourth = Answer(result=1), Answer(result=2), Answer(result=3), Answer(result=4)
+    locals_dict = {
+        'a': first,
+        'nested': {'b': second, 'deeper': {'c': third}},
+        'd': fourth,
+    }
+
+    assert find_answers(locals_dict) == [first, second, third, fourth]
+
+
+def test_find_answers_ignores_other_values():
+    answer = Answer(result='x')
+
+    assert find_answers({'n': 1, 's': 'str', 'empty': {}, 'a': answer}) == [answer]